@@ -0,0 +1,85 @@
+"""Line analyzers which are fed a command's output while it runs.
+
+An analyzer has a `feed(line)` method. It may raise `io.AbortRun` to
+kill the command early.
+"""
+
+import re
+import time
+import collections
+from onslaught import io
+
+
+class Tail (object):
+    """Keep only the last `maxlines` lines."""
+
+    def __init__(self, maxlines):
+        self._lines = collections.deque(maxlen=maxlines)
+        self.dropped = 0
+
+    @property
+    def lines(self):
+        return list(self._lines)
+
+    def feed(self, line):
+        if len(self._lines) == self._lines.maxlen:
+            self.dropped += 1
+        self._lines.append(line)
+
+
+class Writer (object):
+    """Write each line to the file `f`."""
+
+    def __init__(self, f):
+        self.feed = f.write
+
+
+class Rewriter (object):
+    """Feed `rewrite(line)` to each of the `analyzers`."""
+
+    def __init__(self, rewrite, analyzers):
+        self._rewrite = rewrite
+        self._analyzers = analyzers
+
+    def feed(self, line):
+        line = self._rewrite(line)
+        for analyzer in self._analyzers:
+            analyzer.feed(line)
+
+
+class TrialProgress (object):
+    """Count trial's per-test results, reporting progress periodically.
+
+    `report(run, failed)` is called at most once per `interval` seconds.
+    With `failfast`, the first failing test aborts the run.
+    """
+
+    _RESULT_RGX = re.compile(
+        r'\[(OK|FAIL|ERROR|SKIPPED|TODO|SUCCESS|UNEXPECTED SUCCESS)\]\s*$')
+
+    _FAILURES = frozenset(['FAIL', 'ERROR', 'UNEXPECTED SUCCESS'])
+
+    def __init__(self, report, interval=10.0, failfast=False):
+        self._report = report
+        self._interval = interval
+        self._failfast = failfast
+        self._lastreport = time.time()
+        self.run = 0
+        self.failed = 0
+
+    def feed(self, line):
+        m = self._RESULT_RGX.search(line)
+        if m is None:
+            return
+
+        self.run += 1
+        if m.group(1) in self._FAILURES:
+            self.failed += 1
+            if self._failfast:
+                raise io.AbortRun('First test failure: {}'.format(
+                    line.strip()))
+
+        now = time.time()
+        if now - self._lastreport >= self._interval:
+            self._lastreport = now
+            self._report(self.run, self.failed)
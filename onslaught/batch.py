@@ -0,0 +1,168 @@
+"""Run onslaught against many targets in parallel worker processes."""
+
+import os
+import time
+import signal
+import logging
+import traceback
+import multiprocessing
+from onslaught.consts import ExitUserFail, ExitUnknownError
+from onslaught import io
+
+
+# Waiting without a timeout blocks KeyboardInterrupt in python 2:
+_POLL_INTERVAL = 0.5
+
+
+def read_targets(batchfile):
+    """Read target paths, one per line, relative to the batch file.
+
+    Blank lines, lines starting with '#', and repeated targets are
+    ignored.
+    """
+    basedir = io.provider.dirname(io.provider.abspath(batchfile))
+    targets = []
+    for line in io.provider.read(batchfile).splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            target = io.provider.join(basedir, line)
+            if target not in targets:
+                targets.append(target)
+    return targets
+
+
+def results_templates(template, targets):
+    """Map each target to a results directory template of its own.
+
+    Targets may share a package name, and `template` may not mention
+    {package} at all, so each target's results directory gets a suffix
+    naming the target's directory, numbered where those names repeat.
+    """
+    templates = {}
+    labels = set()
+    for target in targets:
+        label = base = io.provider.basename(target.rstrip('/'))
+        n = 2
+        while label in labels:
+            label = '{}-{}'.format(base, n)
+            n += 1
+        labels.add(label)
+
+        # The label is literal text within the template:
+        templates[target] = '{}-{}'.format(
+            template.rstrip('/'),
+            label.replace('{', '{{').replace('}', '}}'))
+    return templates
+
+
+def run_batch(targets, runner, jobs):
+    """Call `runner(target)` for each target in `jobs` worker processes.
+
+    Each target gets a fresh worker process, so sessions never share
+    logging handlers or other process state. Logs a summary table and
+    returns the batch exit status. On Ctrl-C, the workers are killed
+    and the targets which had not finished are summarized as stopped.
+    """
+    log = logging.getLogger('batch')
+    log.info('Running %d targets with %d workers.', len(targets), jobs)
+
+    pool = multiprocessing.Pool(
+        jobs,
+        initializer=_init_worker,
+        maxtasksperchild=1)
+
+    outcomes = []
+    finished = False
+    try:
+        results = pool.imap_unordered(_Worker(runner), targets)
+        while len(outcomes) < len(targets):
+            try:
+                (target, result, duration, errtext) = results.next(
+                    _POLL_INTERVAL)
+            except multiprocessing.TimeoutError:
+                continue
+            log.info('%-7s %7.1fs %s', result, duration, target)
+            if errtext is not None:
+                log.error('Unexpected error for %s:\n%s', target, errtext)
+            outcomes.append((target, result, duration))
+        finished = True
+    except KeyboardInterrupt:
+        log.warning('Interrupted; stopping the remaining targets.')
+    finally:
+        if finished:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+        done = set(target for (target, _, _) in outcomes)
+        stopped = [(t, 'stopped', None) for t in targets if t not in done]
+        log.info('Summary:\n%s', format_summary(sorted(outcomes) + stopped))
+
+    results = set(result for (_, result, _) in outcomes)
+    if stopped or 'error' in results:
+        return ExitUnknownError
+    elif 'failed' in results:
+        return ExitUserFail
+    else:
+        return 0
+
+
+def format_summary(outcomes):
+    width = max([len('Target')] + [len(t) for (t, _, _) in outcomes])
+    rowfmt = '{:<%d}  {:<7}  {:>9}' % (width,)
+
+    lines = [
+        rowfmt.format('Target', 'Result', 'Duration'),
+        '-' * (width + 20),
+    ]
+    for (target, result, duration) in outcomes:
+        if duration is not None:
+            duration = '{:.1f}s'.format(duration)
+        lines.append(rowfmt.format(target, result, duration or '-'))
+
+    return '\n'.join(lines)
+
+
+def _init_worker():
+    # Only the parent reports to the console and handles Ctrl-C; each
+    # session logs to its own results directory. Commands lead their own
+    # process groups, so a Ctrl-C only reaches them through here:
+    signal.signal(signal.SIGINT, _cancel_running)
+    signal.signal(signal.SIGTERM, _terminate)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.NullHandler())
+
+
+def _cancel_running(signum, frame):
+    io.provider.cancel_running()
+
+
+def _terminate(signum, frame):
+    # Pool.terminate kills the worker; take its commands along:
+    io.provider.cancel_running()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+class _Worker (object):
+    def __init__(self, runner):
+        self._runner = runner
+
+    def __call__(self, target):
+        start = time.time()
+        errtext = None
+        try:
+            self._runner(target)
+        except SystemExit as e:
+            result = 'failed' if e.code == ExitUserFail else 'error'
+        except Exception:
+            errtext = traceback.format_exc()
+            result = 'error'
+        else:
+            result = 'passed'
+
+        return (target, result, time.time() - start, errtext)
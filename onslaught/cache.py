@@ -0,0 +1,28 @@
+"""Persistent, content-keyed caches kept across onslaught runs."""
+
+import hashlib
+from onslaught.path import Home
+
+
+class Cache (object):
+    def __init__(self, root):
+        self._root = root
+
+    @property
+    def root(self):
+        return self._root
+
+    def entry(self, kind, *keyparts):
+        """Return the directory of the `kind` entry keyed by `keyparts`."""
+        return self._root(kind, content_key(*keyparts))
+
+
+def content_key(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part)
+        h.update('\0')
+    return h.hexdigest()
+
+
+DefaultCache = Cache(Home('.onslaught'))
@@ -11,17 +11,27 @@ any warnings, print them and exit with an error.
 FailureRgx = re.compile(r'^warning:.*$')
 
 
+class WarningFilter (object):
+    """Collect the failure lines of `setup.py sdist` output as it is fed."""
+
+    def __init__(self):
+        self.warnings = []
+
+    def feed(self, line):
+        if FailureRgx.match(line):
+            self.warnings.append(line)
+
+
 def main(args=sys.argv[1:]):
     parser = argparse.ArgumentParser(description=Description)
     arghelp = 'A file containing the output of `setup.py sdist`.'
     parser.add_argument('SETUP_SDIST_LOG', help=arghelp)
     opts = parser.parse_args(args)
 
-    exitstatus = 0
+    wf = WarningFilter()
     with file(opts.SETUP_SDIST_LOG, 'r') as f:
         for line in f:
-            if FailureRgx.match(line):
-                sys.stdout.write(line)
-                exitstatus = 1
+            wf.feed(line)
 
-    raise SystemExit(exitstatus)
+    sys.stdout.write(''.join(wf.warnings))
+    raise SystemExit(1 if wf.warnings else 0)
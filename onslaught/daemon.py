@@ -0,0 +1,309 @@
+"""Serve onslaught runs from a warm process over a Unix domain socket.
+
+Each request is run in a child forked from the daemon, so it starts with
+every module imported, but keeps its logging and working directory to
+itself. Between runs, the daemon keeps spare clones of the cached
+virtualenv ready for `Session.prepare_virtualenv` to claim.
+
+The protocol is one JSON object per line. The client sends a request with
+its python, cwd, environment, and command line args; the daemon replies
+with any number of {"out": text} or {"err": text} messages, then one
+{"exit": status}, or a single {"refused": reason} if it cannot serve the
+request.
+"""
+
+import os
+import sys
+import json
+import errno
+import signal
+import socket
+import logging
+import argparse
+import threading
+import traceback
+import contextlib
+import SocketServer
+from onslaught.consts import ExitUnknownError
+from onslaught.path import Home
+from onslaught import io
+
+
+DefaultSocket = Home('.onslaught', 'daemon.sock')
+
+Description = """\
+Run an onslaught daemon, which serves later onslaught commands from a
+warm process instead of each starting afresh.
+"""
+
+
+def main(args, runner):
+    """Serve until interrupted; `runner(args)` performs each run."""
+    parser = argparse.ArgumentParser(
+        prog='onslaught daemon',
+        description=Description)
+    parser.add_argument(
+        '--socket',
+        dest='SOCKET',
+        default=DefaultSocket.pathstr,
+        help='Listen on this Unix domain socket. Default: %(default)s')
+    parser.add_argument(
+        '--spares',
+        dest='SPARES',
+        type=int,
+        default=2,
+        help=('Keep this many virtualenv clones ready to move into ' +
+              'place. Default: %(default)s'))
+    opts = parser.parse_args(args)
+
+    log = logging.getLogger('daemon')
+    server = Server(opts.SOCKET, runner, opts.SPARES)
+    log.info('Serving %s on %s', sys.executable, opts.SOCKET)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.fill_spares()
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info('Stopped serving.')
+    finally:
+        server.server_close()
+        os.unlink(opts.SOCKET)
+
+
+def submit(args, sockpath):
+    """Run `args` on the daemon at `sockpath`, echoing its output.
+
+    Returns the run's exit status, or None when no daemon is listening or
+    it serves another python, so the caller should run `args` itself.
+    """
+    log = logging.getLogger('daemon')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with contextlib.closing(sock):
+        try:
+            sock.connect(sockpath)
+        except socket.error as e:
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+            log.debug('No daemon on %r: %s', sockpath, e)
+            return None
+
+        log.debug('Submitting to daemon on %r', sockpath)
+        sock.sendall(_encode(**_to_json(dict(
+            python=sys.executable,
+            cwd=os.getcwd(),
+            environ=dict(os.environ),
+            args=args))))
+
+        for line in sock.makefile('r'):
+            msg = json.loads(line)
+            if 'out' in msg:
+                _echo(sys.stdout, msg['out'])
+            elif 'err' in msg:
+                _echo(sys.stderr, msg['err'])
+            elif 'exit' in msg:
+                return msg['exit']
+            elif 'refused' in msg:
+                log.warn('The daemon refused: %s', msg['refused'])
+                return None
+
+    log.error('The daemon hung up before the run finished.')
+    return ExitUnknownError
+
+
+class Server (SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    def __init__(self, sockpath, runner, spares):
+        self.runner = runner
+        self.spares = spares
+        io.provider.ensure_is_directory(io.provider.dirname(sockpath))
+        _remove_stale_socket(sockpath)
+
+        # Only this user may submit runs:
+        oldmask = os.umask(0o077)
+        try:
+            SocketServer.UnixStreamServer.__init__(
+                self,
+                sockpath,
+                _Handler)
+        finally:
+            os.umask(oldmask)
+
+    def fill_spares(self):
+        # Imported here, since clients only need `submit`:
+        from onslaught.session import Session
+
+        if self.spares == 0:
+            return
+        made = Session().fill_spare_virtualenvs(self.spares)
+        if made:
+            logging.getLogger('daemon').debug(
+                'Made %d spare virtualenvs.', made)
+
+
+class _Handler (SocketServer.StreamRequestHandler):
+    # Runs in a child forked for this request alone.
+
+    def setup(self):
+        SocketServer.StreamRequestHandler.setup(self)
+        self._sendlock = threading.Lock()
+        self._hungup = False
+        self._running = False
+
+    def handle(self):
+        request = _native(json.loads(self.rfile.readline()))
+        if request['python'] != sys.executable:
+            self._send(refused='It runs {}.'.format(sys.executable))
+            return
+
+        self._send(exit=self._run(request))
+
+        # Let a short refill finish, rather than leave a partial clone:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        try:
+            self.server.fill_spares()
+        except Exception:
+            traceback.print_exc(file=sys.__stderr__)
+
+    def _run(self, request):
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['environ'])
+
+        # The run sets up its own console logging, on our channels:
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        sys.stdout = _Channel(self._send, 'out')
+        sys.stderr = _Channel(self._send, 'err')
+
+        # Stop the run, with its commands, on either signal; a daemon
+        # started in the background may even ignore SIGINT:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        self._running = True
+        hangup = threading.Thread(target=self._interrupt_on_hangup)
+        hangup.daemon = True
+        hangup.start()
+
+        try:
+            self.server.runner(request['args'])
+        except SystemExit as e:
+            return _exit_status(e.code)
+        except BaseException:
+            traceback.print_exc()
+            return ExitUnknownError
+        else:
+            return 0
+        finally:
+            with self._sendlock:
+                self._running = False
+            sys.stdout = sys.__stdout__
+            sys.stderr = sys.__stderr__
+
+    def _interrupt_on_hangup(self):
+        # The client sends nothing after its request, so a read only
+        # returns when it goes away, such as on a Ctrl-C:
+        try:
+            self.connection.recv(1)
+        except socket.error:
+            pass
+
+        with self._sendlock:
+            self._hungup = True
+            if self._running:
+                os.kill(os.getpid(), signal.SIGINT)
+
+    def _send(self, **msg):
+        with self._sendlock:
+            if self._hungup:
+                return
+            try:
+                self.connection.sendall(_encode(**msg))
+            except socket.error:
+                self._hungup = True
+
+
+class _Channel (object):
+    """A text stream whose writes go to the client as `key` messages."""
+
+    def __init__(self, send, key):
+        self._send = send
+        self._key = key
+
+    def write(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self._send(**{self._key: _to_json_text(text)})
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def _remove_stale_socket(sockpath):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with contextlib.closing(sock):
+        try:
+            sock.connect(sockpath)
+        except socket.error as e:
+            if e.errno == errno.ENOENT:
+                return
+            elif e.errno != errno.ECONNREFUSED:
+                raise
+        else:
+            raise SystemExit(
+                'A daemon is already serving {}'.format(sockpath))
+
+    os.unlink(sockpath)
+
+
+def _exit_status(code):
+    # As the interpreter treats the code of an uncaught SystemExit:
+    if code is None:
+        return 0
+    elif isinstance(code, int):
+        return code
+    else:
+        sys.stderr.write('{}\n'.format(code))
+        return 1
+
+
+def _to_json(obj):
+    # Paths, args, and the environment are byte strings, which need not be
+    # utf-8 either:
+    if isinstance(obj, str):
+        return _to_json_text(obj)
+    elif isinstance(obj, list):
+        return [_to_json(x) for x in obj]
+    elif isinstance(obj, dict):
+        return dict((_to_json(k), _to_json(v)) for (k, v) in obj.iteritems())
+    else:
+        return obj
+
+
+def _native(obj):
+    # The inverse of _to_json, for a request:
+    if isinstance(obj, unicode):
+        return obj.encode('latin-1')
+    elif isinstance(obj, list):
+        return [_native(x) for x in obj]
+    elif isinstance(obj, dict):
+        return dict((_native(k), _native(v)) for (k, v) in obj.iteritems())
+    else:
+        return obj
+
+
+def _encode(**msg):
+    return json.dumps(msg) + '\n'
+
+
+# Output need not be utf-8, so carry its bytes through latin-1:
+def _to_json_text(data):
+    return data.decode('latin-1')
+
+
+def _echo(stream, text):
+    stream.write(text.encode('latin-1'))
+    stream.flush()
@@ -0,0 +1,309 @@
+"""Keep a history of runs, and report phases which got slower."""
+
+import sys
+import socket
+import sqlite3
+import argparse
+import platform
+from onslaught.consts import ExitUserFail
+from onslaught.path import Home
+from onslaught import io
+
+
+DefaultDatabase = Home('.onslaught', 'history.sqlite')
+
+Description = """\
+Show how the phase durations of recent runs of each package trend, and
+flag phases whose last passing run was slower than their baseline: the
+median of their previous passing runs in the same mode, with the same
+pythons, --jobs, and --test-jobs. Phases which reused a cached result
+show as "c" and are left out of the baselines.
+"""
+
+_Schema = """\
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    package TEXT NOT NULL,
+    target TEXT NOT NULL,
+    started TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    wall REAL NOT NULL,
+    coverage REAL,
+    python TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    host TEXT NOT NULL,
+    jobs INTEGER NOT NULL,
+    testjobs INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phases (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    passed INTEGER NOT NULL,
+    cached INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_package ON runs (package, id);
+"""
+
+# A slowdown is only flagged when it is also at least this many seconds,
+# since short phases are noisy:
+_MIN_SLOWDOWN = 0.5
+
+# Fewer baseline samples than this flag nothing:
+_MIN_BASELINE_RUNS = 3
+
+# Marks the recent durations of phases which reused a cached result:
+_Cached = 'cached'
+
+
+def main(args, database=DefaultDatabase):
+    """Print the history report; return the exit status."""
+    parser = argparse.ArgumentParser(
+        prog='onslaught history',
+        description=Description)
+    parser.add_argument(
+        'PACKAGE',
+        nargs='*',
+        help='Only report on these packages. Default: all of them.')
+    parser.add_argument(
+        '--runs', '-n',
+        dest='RUNS',
+        type=int,
+        default=10,
+        help='Show the durations of this many recent runs. '
+             'Default: %(default)s')
+    parser.add_argument(
+        '--window',
+        dest='WINDOW',
+        type=int,
+        default=10,
+        help='The baseline is the median of this many previous runs. '
+             'Default: %(default)s')
+    parser.add_argument(
+        '--threshold',
+        dest='THRESHOLD',
+        type=float,
+        default=1.25,
+        help='Flag phases slower than their baseline by this factor. '
+             'Default: %(default)s')
+    parser.add_argument(
+        '--check',
+        dest='CHECK',
+        action='store_true',
+        default=False,
+        help='Exit with a failure status if any phase is flagged.')
+    opts = parser.parse_args(args)
+
+    if not database.exists:
+        sys.stdout.write('No runs recorded yet.\n')
+        return 0
+
+    history = History(database.pathstr)
+    flagged = False
+    for package in (opts.PACKAGE or history.packages()):
+        report = history.report(
+            package,
+            opts.RUNS,
+            opts.WINDOW,
+            opts.THRESHOLD)
+        sys.stdout.write(format_report(report))
+        flagged = flagged or any(p['slower'] for p in report['phases'])
+
+    return ExitUserFail if opts.CHECK and flagged else 0
+
+
+class History (object):
+    def __init__(self, path):
+        io.provider.ensure_is_directory(io.provider.dirname(path))
+
+        # Concurrent batch workers append to the same database:
+        self._db = sqlite3.connect(path, timeout=60)
+        self._db.executescript(_Schema)
+
+    def record(self, summary, status, wall, phases):
+        """Append a finished run.
+
+        `summary` is a `Session.run_summary`, and `phases` lists a
+        (name, seconds, passed, cached) tuple for each phase which ran.
+        """
+        with self._db:
+            cursor = self._db.execute(
+                'INSERT INTO runs (package, target, started, mode, status, '
+                'wall, coverage, python, platform, host, jobs, testjobs) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (summary['package'],
+                 summary['target'],
+                 summary['started'],
+                 summary['mode'],
+                 status,
+                 wall,
+                 summary['coverage'],
+                 summary['python'],
+                 platform.platform(),
+                 socket.gethostname(),
+                 summary['jobs'],
+                 summary['testjobs']))
+            self._db.executemany(
+                'INSERT INTO phases (run, name, seconds, passed, cached) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(cursor.lastrowid, name, seconds, passed, cached)
+                 for (name, seconds, passed, cached) in phases])
+
+    def packages(self):
+        return [
+            package for (package,) in self._db.execute(
+                'SELECT DISTINCT package FROM runs ORDER BY package')
+        ]
+
+    def report(self, package, runs, window, threshold):
+        """Summarize the recent runs of `package` like its latest run.
+
+        Only runs in the latest run's mode, with its pythons, jobs, and
+        test jobs, are compared. Each phase gets its durations in the
+        last `runs` runs, oldest first, with None where it did not pass
+        and _Cached where it reused a cached result, and is `slower` when
+        its latest duration exceeds its `baseline` by `threshold`.
+        """
+        [latest] = self._db.execute(
+            'SELECT id, started, mode, status, wall, coverage, python, '
+            'jobs, testjobs FROM runs '
+            'WHERE package = ? ORDER BY id DESC LIMIT 1',
+            (package,)).fetchall() or [None]
+        if latest is None:
+            return {'package': package, 'latest': None, 'phases': []}
+        (latestid, started, mode, status, wall, coverage,
+         python, jobs, testjobs) = latest
+
+        runids = [
+            runid for (runid,) in self._db.execute(
+                'SELECT id FROM runs WHERE package = ? AND mode = ? '
+                'AND python = ? AND jobs = ? AND testjobs = ? '
+                'ORDER BY id DESC LIMIT ?',
+                (package, mode, python, jobs, testjobs,
+                 max(runs, window + 1)))
+        ]
+        runids.reverse()
+
+        durations = {}
+        order = []
+        for (runid, name, seconds, passed, cached) in self._db.execute(
+                'SELECT run, name, seconds, passed, cached FROM phases '
+                'WHERE run IN ({}) ORDER BY run, rowid'.format(
+                    ', '.join('?' * len(runids))),
+                runids):
+            if name not in durations:
+                durations[name] = {}
+                order.append(name)
+            if cached:
+                durations[name][runid] = _Cached
+            elif passed:
+                durations[name][runid] = seconds
+
+        phases = []
+        for name in order:
+            passing = [durations[name].get(r) for r in runids]
+            latestsecs = _measured(durations[name].get(latestid))
+            samples = [
+                s for s in map(_measured, passing[:-1]) if s is not None
+            ][-window:]
+            baseline = None
+            if len(samples) >= _MIN_BASELINE_RUNS:
+                baseline = _median(samples)
+
+            phases.append({
+                'name': name,
+                'recent': passing[-runs:],
+                'latest': latestsecs,
+                'baseline': baseline,
+                'slower': (
+                    latestsecs is not None and
+                    baseline is not None and
+                    latestsecs > baseline * threshold and
+                    latestsecs - baseline >= _MIN_SLOWDOWN),
+            })
+
+        return {
+            'package': package,
+            'latest': {
+                'started': started,
+                'mode': mode,
+                'python': python,
+                'jobs': jobs,
+                'testjobs': testjobs,
+                'status': status,
+                'wall': wall,
+                'coverage': coverage,
+            },
+            'phases': phases,
+        }
+
+
+def format_report(report):
+    latest = report['latest']
+    if latest is None:
+        return 'No runs of {} recorded.\n\n'.format(report['package'])
+
+    coverage = latest['coverage']
+    width = max([len('Phase')] + [len(p['name']) for p in report['phases']])
+    rowfmt = '{:<%d} {:>9} {:>9} {:>7}  {}' % (width,)
+    lines = [
+        '{}: latest {} run at {} {} in {:.1f}s, coverage {}'.format(
+            report['package'],
+            latest['mode'],
+            latest['started'],
+            'passed' if latest['status'] == 0 else 'failed',
+            latest['wall'],
+            'n/a' if coverage is None else '{:.1f}%'.format(coverage)),
+        'Compared with runs of {} with --jobs {} --test-jobs {}.'.format(
+            latest['python'],
+            latest['jobs'],
+            latest['testjobs']),
+        '',
+        rowfmt.format('Phase', 'Baseline', 'Latest', 'Change', 'Recent'),
+    ]
+    for phase in report['phases']:
+        (baseline, latestsecs) = (phase['baseline'], phase['latest'])
+        change = ''
+        if baseline and latestsecs is not None:
+            change = '{:+.0%}'.format(latestsecs / baseline - 1)
+
+        recent = ' '.join(_recent(s) for s in phase['recent'])
+        if phase['slower']:
+            recent += '  SLOWER'
+
+        lines.append(rowfmt.format(
+            phase['name'],
+            _seconds(baseline),
+            _seconds(latestsecs),
+            change,
+            recent))
+
+    return '\n'.join(lines) + '\n\n'
+
+
+def _recent(seconds):
+    if seconds is None:
+        return '-'
+    elif seconds is _Cached:
+        return 'c'
+    else:
+        return '{:.1f}'.format(seconds)
+
+
+def _measured(seconds):
+    # Cached phases took no time worth comparing:
+    return None if seconds is _Cached else seconds
+
+
+def _seconds(seconds):
+    return '-' if seconds is None else '{:.2f}s'.format(seconds)
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    else:
+        return (values[mid - 1] + values[mid]) / 2.0
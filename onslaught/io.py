@@ -1,25 +1,66 @@
 """Wrap all I/O to allow test specifications at this layer."""
 
 import os
+import sys
+import stat
+import time
 import errno
+import signal
 import shutil
+import fnmatch
+import hashlib
+import tarfile
 import subprocess
 import logging
+import threading
+import contextlib
+import collections
+from distutils.spawn import find_executable
+
+# Python 2 needs the scandir backport, which setup.py requires; without
+# it, each entry costs an lstat of its own:
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 
 CalledProcessError = subprocess.CalledProcessError
 STDOUT = subprocess.STDOUT
 
 
+class AbortRun (Exception):
+    """Raised by a `run_with_usage` feed to kill the running command."""
+
+
+class Cancelled (Exception):
+    """Raised for a command which `cancel_running` killed."""
+
+
+# Resource usage of a finished child process; times are in seconds and
+# `maxrss` is the peak resident set size in KiB:
+ProcessUsage = collections.namedtuple(
+    'ProcessUsage',
+    ['returncode', 'wall', 'utime', 'stime', 'maxrss'])
+
+
 class IOProvider (object):
     def __init__(self):
         self._debug = logging.getLogger('IOProvider').debug
 
         self.environ = os.environ
 
+        self._childlock = threading.Lock()
+        self._children = set()
+
         delegatees = [
+            find_executable,
             os.chdir,
             os.getcwd,
+            os.getpid,
             os.listdir,
             os.path.abspath,
             os.path.basename,
@@ -29,19 +70,145 @@ class IOProvider (object):
             os.path.isabs,
             os.path.isfile,
             os.path.join,
+            os.rename,
             os.walk,
-            subprocess.check_call,
             ]
 
         for d in delegatees:
             setattr(self, d.__name__, d)
 
     # Subprocess I/O:
-    def gather_output(self, *args):
-        return subprocess.check_output(args).strip()
+    def gather_output(self, *args, **kw):
+        """Return the stripped stdout of `args`, like check_output.
+
+        With `timeout`, the command is killed after that many seconds,
+        which raises CalledProcessError.
+        """
+        timeout = kw.pop('timeout', None)
+        assert len(kw) == 0, 'Unexpected keyword args: {!r}'.format(kw)
+
+        proc = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            preexec_fn=os.setsid)
+        with self._supervise(proc, args, timeout) as child:
+            output = proc.communicate()[0]
+
+        if child.killedby == 'cancel':
+            raise Cancelled(args)
+        elif proc.returncode != 0:
+            raise CalledProcessError(proc.returncode, args, output)
+        else:
+            return output.strip()
 
-    def run(self, args, **kw):
-        return subprocess.check_call(args, **kw)
+    def run_with_usage(self, args, feed=None, timeout=None, **kw):
+        """Run `args` to completion and return its ProcessUsage.
+
+        Keyword args go to subprocess.Popen. A nonzero exit status is
+        only reported in the result, not raised.
+
+        With `feed`, the child's stdout is read through a pipe while it
+        runs; each line is written to the `stdout` file, then passed to
+        `feed(line)`. If `feed` raises AbortRun, the child is killed.
+
+        The child leads a new process group, and every kill takes the
+        whole group, so no grandchildren are left running. With
+        `timeout`, the group is killed after that many seconds. If
+        `cancel_running` kills it, Cancelled is raised once it exits.
+        """
+        start = time.time()
+        outfile = kw.get('stdout')
+        if feed is not None:
+            kw['stdout'] = subprocess.PIPE
+        proc = subprocess.Popen(args, preexec_fn=os.setsid, **kw)
+
+        with self._supervise(proc, args, timeout) as child:
+            if feed is not None:
+                try:
+                    for line in iter(proc.stdout.readline, ''):
+                        outfile.write(line)
+                        feed(line)
+                except AbortRun as e:
+                    outfile.write('\n[onslaught] Aborted: {}\n'.format(e))
+                    child.kill('abort')
+                except BaseException:
+                    child.kill('error')
+                    proc.wait()
+                    raise
+                finally:
+                    proc.stdout.close()
+
+            while True:
+                try:
+                    (_, status, rusage) = os.wait4(proc.pid, 0)
+                except os.error as e:
+                    if e.errno != errno.EINTR:
+                        raise
+                else:
+                    break
+        wall = time.time() - start
+
+        if child.killedby == 'cancel':
+            raise Cancelled(args)
+        elif child.killedby == 'timeout' and feed is not None:
+            note = '\n[onslaught] Timed out after {}s\n'.format(timeout)
+            outfile.write(note)
+            feed(note)
+
+        # Record the status ourselves, since the child is now reaped:
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+
+        maxrss = rusage.ru_maxrss
+        if sys.platform == 'darwin':
+            maxrss //= 1024  # Reported in bytes rather than KiB.
+
+        return ProcessUsage(
+            proc.returncode,
+            wall,
+            rusage.ru_utime,
+            rusage.ru_stime,
+            maxrss)
+
+    def is_running(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                return False
+            elif e.errno != errno.EPERM:
+                raise
+        return True
+
+    def cancel_running(self):
+        """Kill the process groups of all commands still running."""
+        with self._childlock:
+            children = list(self._children)
+        for child in children:
+            child.kill('cancel')
+
+    @contextlib.contextmanager
+    def _supervise(self, proc, args, timeout):
+        # Track `proc` for cancel_running and a timeout, until reaped:
+        child = _Child(proc, args, self._debug)
+        watchdog = None
+        if timeout is not None:
+            watchdog = threading.Timer(timeout, child.kill, ['timeout'])
+            watchdog.daemon = True
+            watchdog.start()
+
+        with self._childlock:
+            self._children.add(child)
+        try:
+            yield child
+        finally:
+            child.reaped()
+            if watchdog is not None:
+                watchdog.cancel()
+            with self._childlock:
+                self._children.discard(child)
 
     # File I/O:
     def copyfile(self, src, dst):
@@ -49,8 +216,143 @@ class IOProvider (object):
         shutil.copyfile(src, dst)
 
     def copytree(self, src, dst):
+        """Copy the tree at `src` to a new `dst`, with symlinks as such.
+
+        Files keep their modes and times, as with shutil.copy2.
+        """
         self._debug('cp -r %r %r', src, dst)
-        shutil.copytree(src, dst, symlinks=True)
+        os.makedirs(dst)
+        dirs = [(dst, os.stat(src))]
+        for (relpath, entry) in self.scantree(src):
+            dstpath = os.path.join(dst, relpath)
+            st = entry.stat(follow_symlinks=False)
+
+            if entry.is_symlink():
+                os.symlink(os.readlink(entry.path), dstpath)
+            elif entry.is_dir(follow_symlinks=False):
+                os.mkdir(dstpath)
+                dirs.append((dstpath, st))
+            else:
+                shutil.copyfile(entry.path, dstpath)
+                _copy_file_state(st, dstpath)
+
+        # Directory modes go last, in case they forbid writes:
+        for (dstpath, st) in reversed(dirs):
+            _copy_file_state(st, dstpath)
+
+    def scantree(self, path, exclude=(), include=None):
+        """Yield a (relpath, entry) pair for each entry under `path`.
+
+        Entries come sorted, each directory before its contents, and
+        symlinks are not followed. Entries whose basename matches an
+        `exclude` glob, as in `synctree`, are skipped with their contents.
+        With `include`, only entries for which `include(entry)` holds are
+        yielded, though every directory is still descended.
+
+        Each entry is a DirEntry, which caches its type and lstat result:
+        prefer `entry.is_dir(follow_symlinks=False)` and
+        `entry.stat(follow_symlinks=False)` to new syscalls on its `path`.
+        """
+        return self._scantree(path, '', exclude, include)
+
+    def _scantree(self, path, rel, exclude, include):
+        for entry in _sorted_entries(path):
+            if _is_excluded(rel, entry.name, exclude):
+                continue
+
+            relpath = os.path.join(rel, entry.name)
+            if include is None or include(entry):
+                yield (relpath, entry)
+
+            if entry.is_dir(follow_symlinks=False):
+                for item in self._scantree(
+                        entry.path,
+                        relpath,
+                        exclude,
+                        include):
+                    yield item
+
+    def synctree(self, src, dst, exclude=()):
+        """Make `dst` an exact copy of `src`, copying only changed entries.
+
+        Regular files are unchanged when their size, mode, and mtime
+        match. Entries whose basename matches an `exclude` glob are
+        neither copied nor kept in `dst`; globs starting with '/' only
+        match at the top of `src`. Symlinks are copied as symlinks.
+
+        Returns the sorted relative paths which were copied or removed,
+        leaving out removals of excluded entries.
+        """
+        self._debug('sync %r %r', src, dst)
+        changed = []
+        self._synctree(src, dst, '', exclude, changed)
+        return sorted(changed)
+
+    def _synctree(self, src, dst, rel, exclude, changed):
+        entries = [
+            e for e in _sorted_entries(src)
+            if not _is_excluded(rel, e.name, exclude)
+        ]
+        names = set(e.name for e in entries)
+
+        if os.path.islink(dst) or not os.path.isdir(dst):
+            self._remove(dst)
+            os.mkdir(dst)
+            shutil.copymode(src, dst)
+
+        for stale in sorted(set(os.listdir(dst)) - names):
+            self._remove(os.path.join(dst, stale))
+            if not _is_excluded(rel, stale, exclude):
+                changed.append(os.path.join(rel, stale))
+
+        for entry in entries:
+            dstpath = os.path.join(dst, entry.name)
+            relpath = os.path.join(rel, entry.name)
+
+            if entry.is_dir(follow_symlinks=False):
+                self._synctree(entry.path, dstpath, relpath, exclude, changed)
+
+            elif entry.is_symlink():
+                link = os.readlink(entry.path)
+                if not (os.path.islink(dstpath) and
+                        os.readlink(dstpath) == link):
+                    self._remove(dstpath)
+                    os.symlink(link, dstpath)
+                    changed.append(relpath)
+
+            else:
+                srcst = entry.stat(follow_symlinks=False)
+                if not _is_same_file_state(srcst, dstpath):
+                    self._remove(dstpath)
+                    shutil.copyfile(entry.path, dstpath)
+                    _copy_file_state(srcst, dstpath)
+                    changed.append(relpath)
+
+    def treehash(self, path, exclude=()):
+        """Return a sha256 hex digest of the tree at `path`.
+
+        It covers relative paths, modes, file contents, and symlink
+        targets, leaving out entries matching `exclude` as in `synctree`.
+        """
+        h = hashlib.sha256()
+        for (relpath, entry) in self.scantree(path, exclude):
+            st = entry.stat(follow_symlinks=False)
+            h.update('{}\0{:o}\0'.format(relpath, st.st_mode))
+
+            if stat.S_ISLNK(st.st_mode):
+                h.update(os.readlink(entry.path))
+            elif stat.S_ISREG(st.st_mode):
+                h.update('{}\0'.format(st.st_size))
+                with file(entry.path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(64 * 1024), ''):
+                        h.update(chunk)
+        return h.hexdigest()
+
+    def _remove(self, path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
 
     def ensure_is_directory(self, path):
         try:
@@ -75,13 +377,140 @@ class IOProvider (object):
         with self.open(path, 'w') as f:
             return f.write(contents)
 
+    def tarnames(self, path):
+        with tarfile.open(path) as tf:
+            return tf.getnames()
+
     def rmtree(self, path):
         self._debug('rm -rf %r', path)
         try:
-            shutil.rmtree(path)
+            self._remove(path)
         except os.error as e:
             if e.errno != errno.ENOENT:
                 raise
 
+    def rmtree_background(self, path):
+        """Remove `path` in a daemon thread, which an exit may cut short."""
+        def remove():
+            try:
+                self.rmtree(path)
+            except os.error as e:
+                logging.getLogger('IOProvider').warn(
+                    'Could not remove %r: %s', path, e)
+
+        t = threading.Thread(target=remove, name='rmtree')
+        t.daemon = True
+        t.start()
+        return t
+
+
+class _Child (object):
+    """A supervised command, whose process group is killed at most once."""
+
+    def __init__(self, proc, args, debug):
+        self._proc = proc
+        self._args = args
+        self._debug = debug
+        self._lock = threading.Lock()
+        self._reaped = False
+        self.killedby = None
+
+    def kill(self, reason):
+        with self._lock:
+            # Once reaped, the process group id may be reused:
+            if self._reaped or self.killedby is not None:
+                return
+            self.killedby = reason
+            self._debug('Killing %r: %s', self._args, reason)
+            try:
+                os.killpg(self._proc.pid, signal.SIGKILL)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def reaped(self):
+        with self._lock:
+            self._reaped = True
+
 
 provider = IOProvider()
+
+
+def _is_excluded(rel, name, exclude):
+    for pattern in exclude:
+        if pattern.startswith('/'):
+            if rel == '' and fnmatch.fnmatch(name, pattern[1:]):
+                return True
+        elif fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+def _sorted_entries(path):
+    if scandir is None:
+        entries = [_LstatEntry(path, n) for n in os.listdir(path)]
+    else:
+        entries = list(scandir(path))
+    entries.sort(key=lambda e: e.name)
+    return entries
+
+
+class _LstatEntry (object):
+    """The subset of DirEntry used here, for when scandir is missing."""
+
+    __slots__ = ('name', 'path', '_lstat')
+
+    def __init__(self, dirpath, name):
+        self.name = name
+        self.path = os.path.join(dirpath, name)
+        self._lstat = None
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks and self.is_symlink():
+            return os.stat(self.path)
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        return self._lstat
+
+    def is_symlink(self):
+        return stat.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+
+    def is_dir(self, follow_symlinks=True):
+        return self._is(stat.S_ISDIR, follow_symlinks)
+
+    def is_file(self, follow_symlinks=True):
+        return self._is(stat.S_ISREG, follow_symlinks)
+
+    def _is(self, test, follow_symlinks):
+        try:
+            return test(self.stat(follow_symlinks).st_mode)
+        except os.error as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+
+def _copy_file_state(st, dstpath):
+    # What copy2 copies besides contents, from an already known stat:
+    os.utime(dstpath, (st.st_atime, st.st_mtime))
+    os.chmod(dstpath, stat.S_IMODE(st.st_mode))
+
+
+# Copied mtimes round-trip through a float, so allow for lost precision:
+_MTIME_TOLERANCE = 1e-3
+
+
+def _is_same_file_state(srcst, dstpath):
+    try:
+        dstst = os.lstat(dstpath)
+    except os.error as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return False
+
+    return (
+        stat.S_ISREG(dstst.st_mode) and
+        dstst.st_size == srcst.st_size and
+        stat.S_IMODE(dstst.st_mode) == stat.S_IMODE(srcst.st_mode) and
+        abs(dstst.st_mtime - srcst.st_mtime) < _MTIME_TOLERANCE
+    )
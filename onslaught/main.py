@@ -1,105 +1,56 @@
-import sys
-import logging
-import argparse
-import traceback
-from onslaught.consts import ExitUnknownError, DateFormat
-from onslaught.session import Session
-from onslaught import io
+"""The onslaught command.
 
-
-Description = """\
-Run the target python project through an onslaught of style, packaging,
-and unit tests.
+A run submitted to a daemon needs none of the modules which a run in
+this process does, so the daemon is tried before they are imported.
 """
 
+import sys
+import logging
+from onslaught import daemon
 
-def main(args=sys.argv[1:]):
-    opts = parse_args(args)
-    log = logging.getLogger('main')
-    log.debug('Parsed opts: %r', opts)
-
-    try:
-        run_onslaught(opts.TARGET, opts.RESULTS)
-    except Exception:
-        log.error(traceback.format_exc())
-        raise SystemExit(ExitUnknownError)
-
-
-def run_onslaught(target, results):
-    s = Session().initialize(target, results)
-
-    with s.pushd_workdir():
-        s.run_phase_flake8()
-
-        s.prepare_virtualenv()
-        s.install_test_utility_packages()
-
-        s.run_sdist_phases()
-        s.run_phase_unittest()
-
-        s.generate_coverage_reports()
-
-
-def parse_args(args):
-    parser = argparse.ArgumentParser(description=Description)
-
-    loggroup = parser.add_mutually_exclusive_group()
-
-    loggroup.add_argument(
-        '--quiet',
-        action='store_const',
-        const=logging.WARN,
-        dest='loglevel',
-        help='Only log warnings and errors.')
-
-    loggroup.add_argument(
-        '--debug',
-        action='store_const',
-        const=logging.DEBUG,
-        dest='loglevel',
-        help='Log everything.')
-
-    defres = io.provider.expanduser(
-        io.provider.join(
-            '~',
-            '.onslaught',
-            'results',
-            '{package}'))
-
-    parser.add_argument(
-        '--results', '-r',
-        dest='RESULTS',
-        type=str,
-        default=defres,
-        help=('Results directory which will be overwritten. ' +
-              'If "{package}" is present, it is replaced with ' +
-              'the package name. Default: {defres}'
-              .format(defres=defres)))
-
-    parser.add_argument(
-        'TARGET',
-        type=str,
-        nargs='?',
-        default='.',
-        help='Target python source.')
-
-    opts = parser.parse_args(args)
-    init_logging(opts.loglevel)
-    return opts
-
-
-def init_logging(level):
-    if level is None:
-        level = logging.INFO
 
+def main(args=sys.argv[1:]):
+    if args[:1] not in (['daemon'], ['history']):
+        status = submit_args(args)
+        if status is not None:
+            raise SystemExit(status)
+
+    from onslaught import run
+    run.main(args)
+
+
+def submit_args(args):
+    """Submit `args` to a daemon, unless they say --no-daemon.
+
+    Returns as `daemon.submit` does. Only the options which choose the
+    daemon and the console log level are looked for, since `args` are
+    parsed in full wherever they run.
+    """
+    sockpath = daemon.DefaultSocket.pathstr
+    level = logging.INFO
+    for (i, arg) in enumerate(args):
+        if arg == '--':
+            break
+        elif arg == '--no-daemon':
+            return None
+        elif arg == '--socket' and i + 1 < len(args):
+            sockpath = args[i + 1]
+        elif arg.startswith('--socket='):
+            sockpath = arg[len('--socket='):]
+        elif arg == '--quiet':
+            level = logging.WARN
+        elif arg == '--debug':
+            level = logging.DEBUG
+
+    # The run sets up its own logging, wherever it happens:
     root = logging.getLogger()
-    root.setLevel(logging.DEBUG)
-
+    oldlevel = root.level
     handler = logging.StreamHandler(sys.stdout)
     handler.setLevel(level)
-    handler.setFormatter(
-        logging.Formatter(
-            fmt='%(message)s',
-            datefmt=DateFormat))
-
     root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    try:
+        return daemon.submit(args, sockpath)
+    finally:
+        root.removeHandler(handler)
+        root.setLevel(oldlevel)
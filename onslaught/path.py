@@ -2,6 +2,10 @@ from onslaught import io
 
 
 class Path (object):
+    # Many Paths are made for large trees, so keep them small. The derived
+    # names are cached; anything about the filesystem is looked up fresh.
+    __slots__ = ('_p', '_basename', '_parent')
+
     @classmethod
     def from_relative(cls, relpath):
         return cls(io.provider.abspath(relpath))
@@ -9,6 +13,12 @@ class Path (object):
     def __init__(self, path):
         assert io.provider.isabs(path)
         self._p = path
+        self._basename = None
+        self._parent = None
+
+    def __reduce__(self):
+        # Slots rule out the default pickling:
+        return (Path, (self._p,))
 
     @property
     def pathstr(self):
@@ -16,7 +26,9 @@ class Path (object):
 
     @property
     def basename(self):
-        return io.provider.basename(self._p)
+        if self._basename is None:
+            self._basename = io.provider.basename(self._p)
+        return self._basename
 
     @property
     def exists(self):
@@ -24,7 +36,9 @@ class Path (object):
 
     @property
     def parent(self):
-        return Path(io.provider.dirname(self._p))
+        if self._parent is None:
+            self._parent = Path(io.provider.dirname(self._p))
+        return self._parent
 
     @property
     def isfile(self):
@@ -52,6 +66,16 @@ class Path (object):
     def copytree(self, dst):
         return io.provider.copytree(self._p, dst.pathstr)
 
+    def synctree(self, dst, exclude=()):
+        return io.provider.synctree(self._p, dst.pathstr, exclude)
+
+    def treehash(self, exclude=()):
+        return io.provider.treehash(self._p, exclude)
+
+    def scantree(self, exclude=(), include=None):
+        """Yield (relpath, entry) pairs as in `IOProvider.scantree`."""
+        return io.provider.scantree(self._p, exclude, include)
+
     def ensure_is_directory(self):
         io.provider.ensure_is_directory(self._p)
 
@@ -70,19 +94,28 @@ class Path (object):
     def pushd(self):
         return _PushdContext(self)
 
+    def tarnames(self):
+        return io.provider.tarnames(self._p)
+
+    def rename(self, dst):
+        io.provider.rename(self._p, dst.pathstr)
+
     def rmtree(self):
         io.provider.rmtree(self._p)
 
     def walk_files(self):
-        for (bd, ds, fs) in io.provider.walk(self._p):
-            bd = Path(bd)
-            for f in fs:
-                yield bd(f)
+        for (_, entry) in self.scantree(include=_is_file_entry):
+            yield Path(entry.path)
 
 
 Home = Path(io.provider.abspath(io.provider.environ['HOME']))
 
 
+def _is_file_entry(entry):
+    # Like os.walk, count everything but directories as files:
+    return not entry.is_dir()
+
+
 class _PushdContext (object):
     def __init__(self, dest):
         self._d = dest
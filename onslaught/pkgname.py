@@ -0,0 +1,128 @@
+"""Read a project's package name without running its setup.py."""
+
+import re
+import ast
+import ConfigParser
+from StringIO import StringIO
+
+
+# Just enough TOML to find the `name` key of the `[project]` table:
+_TableRgx = re.compile(r'^\s*\[([^\]]+)\]\s*(#.*)?$')
+_NameRgx = re.compile(r'''^\s*name\s*=\s*(["'])([^"']+)\1\s*(#.*)?$''')
+
+
+def static_name(setuppy=None, setupcfg=None, pyproject=None):
+    """Return the package name declared in these file contents, or None.
+
+    As with setuptools, a `name` passed to setup() in `setuppy` wins over
+    the `[metadata]` of `setupcfg`, which wins over the `[project]` table
+    of `pyproject`. None means the name is computed at run time, or could
+    not be found, so only running setup.py can tell.
+    """
+    if setuppy is not None:
+        found = _setuppy_name(setuppy)
+        if found is not _Unset:
+            return found
+
+    for (parse, contents) in [(_setupcfg_name, setupcfg),
+                              (_pyproject_name, pyproject)]:
+        if contents is not None:
+            name = parse(contents)
+            if name is not None:
+                return name
+
+    return None
+
+
+def _setuppy_name(source):
+    """Return the literal `name` passed to setup() in `source`.
+
+    The name may be a string literal, or a module level constant assigned
+    one. Returns None for a name computed otherwise, or when setup() is
+    not called exactly once; returns `_Unset` when setup() takes neither
+    a `name` nor `**kwargs`, which leaves the name to setup.cfg.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+
+    # A setup.py may wrap setup() in a function of its own name:
+    local = set(
+        node.name for node in ast.walk(tree)
+        if isinstance(node, ast.FunctionDef))
+    calls = [
+        node for node in ast.walk(tree)
+        if isinstance(node, ast.Call) and _is_setup(node.func, local)
+    ]
+    if len(calls) != 1:
+        return None
+    [call] = calls
+
+    for kw in call.keywords:
+        if kw.arg == 'name':
+            return _literal_str(kw.value, _constants(tree))
+
+    if call.kwargs is not None:
+        return None
+    return _Unset
+
+
+def _setupcfg_name(contents):
+    parser = ConfigParser.RawConfigParser()
+    try:
+        parser.readfp(StringIO(contents))
+        name = parser.get('metadata', 'name').strip()
+    except ConfigParser.Error:
+        return None
+    return name or None
+
+
+def _pyproject_name(contents):
+    table = None
+    for line in contents.splitlines():
+        m = _TableRgx.match(line)
+        if m:
+            table = m.group(1).strip()
+        elif table == 'project':
+            m = _NameRgx.match(line)
+            if m:
+                return m.group(2)
+    return None
+
+
+# Distinct from None, which means the name is unknowable statically:
+_Unset = object()
+
+
+def _is_setup(func, local):
+    if isinstance(func, ast.Name):
+        return func.id == 'setup' and func.id not in local
+    elif isinstance(func, ast.Attribute):
+        return func.attr == 'setup'
+    else:
+        return False
+
+
+def _constants(tree):
+    # Module level names assigned exactly once, to a string literal:
+    assigned = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    assigned.setdefault(target.id, []).append(node.value)
+
+    return dict(
+        (name, values[0].s)
+        for (name, values) in assigned.iteritems()
+        if len(values) == 1 and isinstance(values[0], ast.Str))
+
+
+def _literal_str(node, constants):
+    if isinstance(node, ast.Str):
+        return node.s
+    elif isinstance(node, ast.Name):
+        return constants.get(node.id)
+    else:
+        return None
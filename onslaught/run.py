@@ -0,0 +1,470 @@
+"""Run onslaught in this process, or serve runs as a daemon."""
+
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import functools
+import contextlib
+import traceback
+import multiprocessing
+from onslaught import daemon, history
+from onslaught.batch import read_targets, results_templates, run_batch
+from onslaught.consts import ExitUnknownError, DateFormat
+from onslaught.schedule import Scheduler
+from onslaught.session import Session
+from onslaught.watch import PollInterval, watch
+from onslaught import io
+
+
+Description = """\
+Run the target python project through an onslaught of style, packaging,
+and unit tests.
+"""
+
+
+def main(args):
+    if args[:1] == ['daemon']:
+        init_logging(None)
+        daemon.main(args[1:], run_args)
+        return
+    elif args[:1] == ['history']:
+        raise SystemExit(history.main(args[1:]))
+
+    run_opts(parse_args(args))
+
+
+def run_args(args):
+    """Perform the run `args` describe here, as the daemon does."""
+    run_opts(parse_args(args))
+
+
+def run_opts(opts):
+    log = logging.getLogger('main')
+    log.debug('Parsed opts: %r', opts)
+
+    sessionopts = dict(
+        failfast=opts.FAILFAST,
+        testjobs=opts.TESTJOBS,
+        fast=opts.FAST,
+        fastrefresh=opts.FASTREFRESH,
+        timeout=opts.TIMEOUT,
+        profile=opts.PROFILE,
+        pythons=opts.PYTHONS or ())
+
+    try:
+        if opts.BATCH is None:
+            run_onslaught(
+                opts.TARGET,
+                opts.RESULTS,
+                opts.JOBS,
+                opts.WATCH,
+                opts.WATCHINTERVAL,
+                **sessionopts)
+        else:
+            targets = read_targets(opts.BATCH)
+            status = run_batch(
+                targets,
+                functools.partial(
+                    run_batch_target,
+                    templates=results_templates(opts.RESULTS, targets),
+                    **sessionopts),
+                opts.JOBS)
+            raise SystemExit(status)
+    except Exception:
+        log.error(traceback.format_exc())
+        raise SystemExit(ExitUnknownError)
+
+
+def run_batch_target(target, templates, **sessionopts):
+    run_onslaught(target, templates[target], **sessionopts)
+
+
+def run_onslaught(target,
+                  results,
+                  jobs=1,
+                  watching=False,
+                  watchinterval=PollInterval,
+                  **sessionopts):
+    s = Session(jobs=jobs, **sessionopts).initialize(target, results)
+    try:
+        with s.pushd_workdir(), _cancel_on_termination(s):
+            sched = schedule_phases(s, jobs)
+            if watching:
+                watch(s, sched, watchinterval)
+            else:
+                run_recorded(s, sched)
+    finally:
+        # Commands lead their own process groups, so they miss a Ctrl-C:
+        s.cancel()
+        s.close()
+
+
+@contextlib.contextmanager
+def _cancel_on_termination(s):
+    """Cancel `s` before a SIGTERM or SIGHUP kills this process.
+
+    Commands lead their own process groups, so these signals would leave
+    them running. Only the signals' default actions are replaced, since
+    batch workers and the daemon handle them already.
+    """
+    def terminate(signum, frame):
+        s.cancel()
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    previous = {}
+    for signum in [signal.SIGTERM, signal.SIGHUP]:
+        if signal.getsignal(signum) == signal.SIG_DFL:
+            previous[signum] = signal.signal(signum, terminate)
+    try:
+        yield
+    finally:
+        for (signum, handler) in previous.iteritems():
+            signal.signal(signum, handler)
+
+
+def run_recorded(s, sched):
+    """Run every phase, then append the finished run to the history."""
+    start = time.time()
+    status = None
+    try:
+        sched.run()
+        status = 0
+    except SystemExit as e:
+        status = e.code
+        raise
+    finally:
+        # Interrupted runs would only skew the trends:
+        if status is not None:
+            if len(s.interpreters) > 1:
+                logging.getLogger('main').info(
+                    'Summary:\n%s',
+                    format_matrix_summary(s, sched))
+            record_history(s, sched, status, time.time() - start)
+
+
+def record_history(s, sched, status, wall):
+    cached = s.cached_phases()
+    phases = [
+        (name,
+         sched.durations[name],
+         name in sched.succeeded,
+         name in cached)
+        for name in sched.names
+        if name in sched.durations
+    ]
+    try:
+        history.History(history.DefaultDatabase.pathstr).record(
+            s.run_summary(),
+            status,
+            wall,
+            phases)
+    except Exception:
+        logging.getLogger('main').warn(
+            'Could not record this run in the history:\n%s',
+            traceback.format_exc())
+
+
+def schedule_phases(s, jobs):
+    # The sdist is built once, then each interpreter installs and tests
+    # it with its own phases. Unless failing fast, an interpreter's
+    # failure stops only its own phases, so the others still report:
+    isolated = len(s.interpreters) > 1 and not s.failfast
+    sched = Scheduler(jobs, cancel=s.cancel)
+    sched.add('flake8', s.run_phase_flake8)
+    for py in s.interpreters:
+        sched.add(
+            py.phase_name('virtualenv'),
+            py.prepare_virtualenv,
+            isolated=isolated)
+    sched.add('setup-sdist', s.run_phase_setup_sdist)
+    sched.add(
+        'check-sdist-log',
+        s.run_phase_check_sdist_log,
+        'setup-sdist')
+
+    for py in s.interpreters:
+        name = py.phase_name
+        sched.add(
+            name('build-wheel'),
+            py.run_phase_build_wheel,
+            name('virtualenv'),
+            'setup-sdist',
+            isolated=isolated)
+        sched.add(
+            name('install-sdist'),
+            py.run_phase_install_sdist,
+            name('build-wheel'),
+            'check-sdist-log',
+            isolated=isolated)
+        sched.add(
+            name('unittests'),
+            py.run_phase_unittest,
+            name('install-sdist'),
+            isolated=isolated)
+        sched.add(
+            name('coverage'),
+            py.generate_coverage_reports,
+            name('unittests'),
+            isolated=isolated)
+    return sched
+
+
+_MatrixPhases = [
+    'virtualenv',
+    'build-wheel',
+    'install-sdist',
+    'unittests',
+    'coverage',
+]
+
+
+def format_matrix_summary(s, sched):
+    """Tabulate each interpreter's result, time, and coverage.
+
+    An interpreter is `stopped` when it could not finish because a
+    shared phase failed, or another interpreter failed with `failfast`.
+    """
+    width = max([len('Python')] + [len(py.label) for py in s.interpreters])
+    rowfmt = '{:<%d}  {:<7}  {:>9}  {:>8}' % (width,)
+
+    lines = [
+        rowfmt.format('Python', 'Result', 'Time', 'Coverage'),
+        '-' * (width + 32),
+    ]
+    for py in s.interpreters:
+        names = [py.phase_name(phase) for phase in _MatrixPhases]
+        if sched.failures.intersection(names):
+            result = 'failed'
+        elif sched.succeeded.issuperset(names):
+            result = 'passed'
+        else:
+            result = 'stopped'
+
+        coverage = py.coverage_total()
+        lines.append(rowfmt.format(
+            py.label,
+            result,
+            '{:.1f}s'.format(sum(sched.durations.get(n, 0) for n in names)),
+            '-' if coverage is None else '{:.1f}%'.format(coverage)))
+
+    return '\n'.join(lines)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=Description)
+
+    loggroup = parser.add_mutually_exclusive_group()
+
+    loggroup.add_argument(
+        '--quiet',
+        action='store_const',
+        const=logging.WARN,
+        dest='loglevel',
+        help='Only log warnings and errors.')
+
+    loggroup.add_argument(
+        '--debug',
+        action='store_const',
+        const=logging.DEBUG,
+        dest='loglevel',
+        help='Log everything.')
+
+    defres = io.provider.expanduser(
+        io.provider.join(
+            '~',
+            '.onslaught',
+            'results',
+            '{package}'))
+
+    parser.add_argument(
+        '--results', '-r',
+        dest='RESULTS',
+        type=str,
+        default=defres,
+        help=('Results directory which will be overwritten. ' +
+              'If "{package}" is present, it is replaced with ' +
+              'the package name. Default: {defres}'
+              .format(defres=defres)))
+
+    defjobs = multiprocessing.cpu_count()
+
+    parser.add_argument(
+        '--jobs', '-j',
+        dest='JOBS',
+        type=int,
+        default=defjobs,
+        help=('Run up to this many independent phases concurrently, ' +
+              'and flake8 in this many processes, ' +
+              'or with --batch, this many targets. ' +
+              'Default: {defjobs}'
+              .format(defjobs=defjobs)))
+
+    parser.add_argument(
+        '--test-jobs',
+        dest='TESTJOBS',
+        type=int,
+        default=1,
+        help=('Run the unittests in this many trial worker processes, ' +
+              'for each --python. Default: %(default)s'))
+
+    parser.add_argument(
+        '--watch', '-w',
+        dest='WATCH',
+        action='store_true',
+        default=False,
+        help=('After the first run, keep watching the target and ' +
+              'rerun the phases which its changes affect.'))
+
+    parser.add_argument(
+        '--watch-interval',
+        dest='WATCHINTERVAL',
+        type=float,
+        default=PollInterval,
+        metavar='SECONDS',
+        help=('With --watch, check the target for changes this often. ' +
+              'Each check stats every file in the target; after a ' +
+              'change, checks repeat quickly until the target is quiet. ' +
+              'Default: %(default)s'))
+
+    parser.add_argument(
+        '--fail-fast', '-x',
+        dest='FAILFAST',
+        action='store_true',
+        default=False,
+        help='Stop the unittests at the first failing test.')
+
+    parser.add_argument(
+        '--fast',
+        dest='FAST',
+        action='store_true',
+        default=False,
+        help=('Only run the test modules which called into files ' +
+              'changed since the last passing run, according to a ' +
+              'test map kept from a previous full run. This is for ' +
+              'quick iteration; coverage only reflects the tests run.'))
+
+    parser.add_argument(
+        '--fast-refresh',
+        dest='FASTREFRESH',
+        action='store_true',
+        default=False,
+        help='Like --fast, but first run all tests to refresh the map.')
+
+    parser.add_argument(
+        '--python', '-p',
+        dest='PYTHONS',
+        action='append',
+        default=None,
+        metavar='PYTHON',
+        help=('Install and test the sdist with this interpreter ' +
+              'instead of the one running onslaught. Repeat this ' +
+              'to test with each of several interpreters concurrently.'))
+
+    parser.add_argument(
+        '--profile',
+        dest='PROFILE',
+        action='store_true',
+        default=False,
+        help=('Run the unittests in one process under cProfile, and ' +
+              'save the stats in profile.pstats and collapsed stacks ' +
+              'in profile.collapsed in the results directory.'))
+
+    parser.add_argument(
+        '--timeout',
+        dest='TIMEOUT',
+        type=float,
+        default=None,
+        help=('Kill any single command, and fail its phase, once it ' +
+              'runs for this many seconds. This limits each command ' +
+              'a phase runs, not the phase as a whole. ' +
+              'Default: no timeout.'))
+
+    parser.add_argument(
+        '--batch', '-b',
+        dest='BATCH',
+        type=str,
+        default=None,
+        help=('Run each target listed in this file, one per line, ' +
+              'in parallel worker processes and summarize the ' +
+              'results. Relative targets are relative to the file.'))
+
+    parser.add_argument(
+        '--no-daemon',
+        dest='NODAEMON',
+        action='store_true',
+        default=False,
+        help=('Run here even if an onslaught daemon is listening. ' +
+              'Start one with: onslaught daemon'))
+
+    parser.add_argument(
+        '--socket',
+        dest='SOCKET',
+        type=str,
+        default=daemon.DefaultSocket.pathstr,
+        help=('Submit the run to a daemon listening on this socket, ' +
+              'if any. Default: {}'.format(daemon.DefaultSocket.pathstr)))
+
+    parser.add_argument(
+        'TARGET',
+        type=str,
+        nargs='?',
+        default=None,
+        help='Target python source. Default: .')
+
+    opts = parser.parse_args(args)
+    if opts.JOBS < 1:
+        parser.error('--jobs must be at least 1')
+    if opts.TESTJOBS < 1:
+        parser.error('--test-jobs must be at least 1')
+    if opts.WATCHINTERVAL <= 0:
+        parser.error('--watch-interval must be positive')
+    if opts.TIMEOUT is not None and opts.TIMEOUT <= 0:
+        parser.error('--timeout must be positive')
+    if opts.PROFILE and (opts.FAST or opts.FASTREFRESH):
+        parser.error('--profile cannot be combined with --fast')
+    if opts.PROFILE and opts.TESTJOBS > 1:
+        parser.error('--profile runs the unittests in one process; '
+                     'it cannot be combined with --test-jobs')
+    if len(opts.PYTHONS or ()) > 1 and (opts.FAST or opts.FASTREFRESH):
+        parser.error('--fast tests with only one --python')
+
+    # The shell leaves a ~ unexpanded after --python=, and a missing
+    # interpreter would otherwise only fail once the run started:
+    if opts.PYTHONS is not None:
+        opts.PYTHONS = [io.provider.expanduser(p) for p in opts.PYTHONS]
+        for python in opts.PYTHONS:
+            if io.provider.find_executable(python) is None:
+                parser.error(
+                    '--python {!r} is not an interpreter'.format(python))
+
+    if opts.BATCH is None:
+        if opts.TARGET is None:
+            opts.TARGET = '.'
+    elif opts.TARGET is not None:
+        parser.error('TARGET cannot be combined with --batch')
+    elif opts.WATCH:
+        parser.error('--watch cannot be combined with --batch')
+
+    init_logging(opts.loglevel)
+    return opts
+
+
+def init_logging(level):
+    if level is None:
+        level = logging.INFO
+
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(level)
+    handler.setFormatter(
+        logging.Formatter(
+            fmt='%(message)s',
+            datefmt=DateFormat))
+
+    root.addHandler(handler)
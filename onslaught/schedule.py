@@ -0,0 +1,146 @@
+"""Run a dependency graph of jobs with bounded concurrency."""
+
+import sys
+import time
+import logging
+import threading
+from onslaught.io import Cancelled
+
+
+class Scheduler (object):
+    # Waiting without a timeout blocks KeyboardInterrupt in python 2:
+    _POLL_INTERVAL = 0.5
+
+    def __init__(self, jobs, cancel=None):
+        assert jobs >= 1, jobs
+        self._jobs = jobs
+        self._cancel = cancel
+        self._log = logging.getLogger(type(self).__name__)
+        self._tasks = {}
+        self._order = []
+        self._isolated = set()
+        self.succeeded = set()
+        self.durations = {}
+        self.failed = None
+        self.failures = set()
+        self.cancelled = set()
+
+    def add(self, name, func, *deps, **kw):
+        """Add task `name` which runs `func()` after all of `deps`.
+
+        Dependencies must be added before their dependents, which also
+        rules out cycles. When an `isolated` task fails, only its
+        dependents are skipped, and the other tasks carry on.
+        """
+        isolated = kw.pop('isolated', False)
+        assert len(kw) == 0, 'Unexpected keyword args: {!r}'.format(kw)
+        assert name not in self._tasks, 'Duplicate task: {!r}'.format(name)
+        for dep in deps:
+            assert dep in self._tasks, 'Unknown dep: {!r}'.format(dep)
+
+        self._tasks[name] = (func, frozenset(deps))
+        self._order.append(name)
+        if isolated:
+            self._isolated.add(name)
+
+    @property
+    def names(self):
+        return list(self._order)
+
+    def dependents(self, names):
+        """Return `names` plus the tasks transitively depending on them."""
+        closure = set(names)
+        for name in self._order:
+            if self._tasks[name][1] & closure:
+                closure.add(name)
+        return closure
+
+    def run(self, only=None):
+        """Run all tasks, or those in `only`, at most `jobs` at a time.
+
+        Tasks left out of `only` count as already done. Once any task
+        which is not `isolated` raises, no new tasks are started and
+        `cancel()` is called to stop the running ones. An `isolated`
+        task which raises only keeps its dependents from starting. After
+        the tasks finish, the first exception is reraised in this
+        thread. Either way, the tasks which ran successfully are left in
+        `succeeded`, the seconds each task which ran took in
+        `durations`, the names of the tasks which failed in `failures`,
+        and the name of the first of them, if any, in `failed`. Tasks
+        which raise Cancelled, because `cancel()` stopped them, are left
+        in `cancelled` instead of `failures`.
+        """
+        cond = threading.Condition()
+        pending = [n for n in self._order if only is None or n in only]
+        running = set()
+        done = set(self._order) - set(pending)
+        errors = []
+        stopped = []
+        self.succeeded = set()
+        self.durations = {}
+        self.failed = None
+        self.failures = set()
+        self.cancelled = set()
+
+        def run_task(name, func):
+            start = time.time()
+            try:
+                func()
+            except BaseException:
+                excinfo = sys.exc_info()
+            else:
+                excinfo = None
+
+            with cond:
+                self.durations[name] = time.time() - start
+                running.remove(name)
+                stop = False
+                if excinfo is None:
+                    done.add(name)
+                    self.succeeded.add(name)
+                else:
+                    errors.append(excinfo)
+                    if issubclass(excinfo[0], Cancelled):
+                        self.cancelled.add(name)
+                    else:
+                        if self.failed is None:
+                            self.failed = name
+                        self.failures.add(name)
+                    if name in self._isolated:
+                        skipped = self.dependents([name])
+                        pending[:] = [n for n in pending if n not in skipped]
+                    else:
+                        stop = not stopped
+                        stopped.append(name)
+                cond.notify()
+
+            if stop and self._cancel is not None:
+                self._log.debug('Task %r failed; cancelling the rest', name)
+                self._cancel()
+
+        with cond:
+            while running or (pending and not stopped):
+                if not stopped:
+                    for name in self._ready(pending, done, running):
+                        func, _ = self._tasks[name]
+                        pending.remove(name)
+                        running.add(name)
+                        self._log.debug('Starting task %r', name)
+
+                        t = threading.Thread(
+                            target=run_task,
+                            name=name,
+                            args=(name, func))
+                        t.daemon = True
+                        t.start()
+
+                cond.wait(self._POLL_INTERVAL)
+
+        if errors:
+            [(etype, evalue, etb)] = errors[:1]
+            raise etype, evalue, etb
+
+    def _ready(self, pending, done, running):
+        slots = self._jobs - len(running)
+        ready = [n for n in pending if self._tasks[n][1] <= done]
+        return ready[:max(0, slots)]
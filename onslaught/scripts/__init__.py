@@ -0,0 +1,6 @@
+"""Scripts which onslaught runs with the target virtualenv's python.
+
+They are kept apart from onslaught's own modules, because a script's
+directory comes first on its path, where a module such as onslaught's
+io would shadow the standard library's.
+"""
@@ -0,0 +1,97 @@
+"""Write the HTML, text, and JSON coverage reports from one data load.
+
+Onslaught runs this file as a script with the target virtualenv's
+python, so it may only import the standard library and coverage.
+"""
+
+import os
+import sys
+import json
+import argparse
+from distutils.sysconfig import get_python_lib
+
+
+Description = """\
+Report on a coverage data file, naming source files relative to
+site-packages: write an HTML report, a JSON summary, and print a text
+summary.
+"""
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=Description)
+    parser.add_argument(
+        '--data-file',
+        required=True,
+        help='The coverage data file.')
+    parser.add_argument(
+        '--html-dir',
+        required=True,
+        help='Directory to write the HTML report into.')
+    parser.add_argument(
+        '--json',
+        required=True,
+        help='File to write the JSON summary into.')
+    opts = parser.parse_args(args)
+
+    # coverage names files relative to the cwd at construction:
+    os.chdir(get_python_lib())
+
+    import coverage
+    cov = coverage.Coverage(data_file=opts.data_file)
+    cov.load()
+    share_analyses(cov)
+
+    cov.html_report(directory=opts.html_dir)
+    cov.report(file=sys.stdout, show_missing=False)
+
+    with open(opts.json, 'w') as f:
+        json.dump(summarize(cov), f, indent=2, sort_keys=True)
+
+
+def share_analyses(cov):
+    """Analyze each source file once, for all of the reports on `cov`."""
+    analyses = {}
+    analyze = cov._analyze
+
+    def shared_analyze(it):
+        key = getattr(it, 'filename', it)
+        if key not in analyses:
+            analyses[key] = analyze(it)
+        return analyses[key]
+
+    cov._analyze = shared_analyze
+
+
+def summarize(cov):
+    from coverage.results import Numbers
+
+    files = {}
+    total = Numbers()
+    for fr in cov._get_file_reporters():
+        analysis = cov._analyze(fr)
+        summary = _numbers_summary(analysis.numbers)
+        summary['missing_lines'] = analysis.missing_formatted()
+        files[fr.relative_filename()] = summary
+        total += analysis.numbers
+
+    return {
+        'files': files,
+        'total': _numbers_summary(total),
+    }
+
+
+def _numbers_summary(nums):
+    return {
+        'statements': nums.n_statements,
+        'missing': nums.n_missing,
+        'excluded': nums.n_excluded,
+        'branches': nums.n_branches,
+        'partial_branches': nums.n_partial_branches,
+        'missing_branches': nums.n_missing_branches,
+        'percent_covered': nums.pc_covered,
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Run trial, recording which source files each test module calls into.
+
+Onslaught runs this file as a script with the target virtualenv's
+python, so it may only import the standard library and twisted.
+"""
+
+import os
+import sys
+import json
+import threading
+from distutils.sysconfig import get_python_lib
+
+
+Usage = """\
+Usage: testmap.py MAP_JSON [TRIAL_ARG ...]
+
+Run trial with TRIAL_ARGs, then write a JSON object to MAP_JSON mapping
+the module name of each test to the files, relative to site-packages,
+whose functions its tests called.
+"""
+
+
+def main(args=sys.argv[1:]):
+    if not args or args[0].startswith('-'):
+        sys.stderr.write(Usage)
+        raise SystemExit(2)
+
+    mappath = args[0]
+    recorder = Recorder(get_python_lib())
+    recorder.install()
+    try:
+        from twisted.scripts.trial import run
+        sys.argv = ['trial'] + args[1:]
+        run()
+    finally:
+        recorder.uninstall()
+        with open(mappath, 'w') as f:
+            json.dump(recorder.testmap(), f, indent=2, sort_keys=True)
+
+
+class Recorder (object):
+    """Attribute each python function call to the running test."""
+
+    def __init__(self, root):
+        self._root = os.path.join(root, '')
+        self._calls = {}
+        self._current = None
+
+    def install(self):
+        from twisted.trial.reporter import TestResult
+
+        self._startTest = TestResult.startTest
+        self._stopTest = TestResult.stopTest
+        recorder = self
+
+        def startTest(result, test):
+            recorder._current = recorder._calls.setdefault(test.id(), set())
+            return recorder._startTest(result, test)
+
+        def stopTest(result, test):
+            recorder._current = None
+            return recorder._stopTest(result, test)
+
+        TestResult.startTest = startTest
+        TestResult.stopTest = stopTest
+        threading.setprofile(self._profile)
+        sys.setprofile(self._profile)
+
+    def uninstall(self):
+        from twisted.trial.reporter import TestResult
+
+        sys.setprofile(None)
+        threading.setprofile(None)
+        TestResult.startTest = self._startTest
+        TestResult.stopTest = self._stopTest
+
+    def testmap(self):
+        testmap = {}
+        for (testid, filenames) in self._calls.items():
+            module = _test_module(testid)
+            testmap.setdefault(module, set()).update(
+                f[len(self._root):]
+                for f in filenames
+                if f.startswith(self._root))
+
+        return dict((m, sorted(fs)) for (m, fs) in testmap.items())
+
+    def _profile(self, frame, event, arg):
+        if event == 'call' and self._current is not None:
+            self._current.add(frame.f_code.co_filename)
+
+
+def _test_module(testid):
+    # Test ids are dotted module, class, and method names:
+    name = testid
+    while name not in sys.modules and '.' in name:
+        name = name.rsplit('.', 1)[0]
+    return name
+
+
+if __name__ == '__main__':
+    main()
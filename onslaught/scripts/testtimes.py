@@ -0,0 +1,215 @@
+"""Run a test script, recording how long each test takes.
+
+Onslaught runs this file as a script with the target virtualenv's
+python, so it may only import the standard library and twisted.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import runpy
+import pstats
+import cProfile
+import argparse
+
+
+Description = """\
+Run python SCRIPT, such as trial, with ARGs in this process, then write a
+JSON object to TIMES_JSON mapping the id of each test which ran to its
+duration in seconds.
+"""
+
+# Collapsed stacks leave out paths which took less than this share of
+# the profiled time:
+_MIN_STACK_SHARE = 1e-4
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        prog='testtimes.py',
+        description=Description)
+    parser.add_argument('TIMES_JSON')
+    parser.add_argument(
+        '--profile',
+        dest='PROFILE',
+        help=('Run SCRIPT under cProfile, saving its stats in ' +
+              'PROFILE.pstats and collapsed stacks in PROFILE.collapsed.'))
+    parser.add_argument(
+        '--rewrite',
+        dest='REWRITE',
+        nargs=2,
+        metavar=('REGEX', 'REPL'),
+        help='Replace REGEX with REPL in the profiled paths.')
+    parser.add_argument('SCRIPT')
+    parser.add_argument('ARG', nargs=argparse.REMAINDER)
+    opts = parser.parse_args(args)
+
+    timer = Timer()
+    profiler = cProfile.Profile() if opts.PROFILE else None
+    sys.argv = [opts.SCRIPT] + opts.ARG
+    # As python would run SCRIPT, so that trial's workers, which inherit
+    # the path, import from its directory instead of this one:
+    sys.path[0] = os.path.dirname(os.path.abspath(opts.SCRIPT))
+    timer.install()
+    try:
+        if profiler is None:
+            runpy.run_path(opts.SCRIPT, run_name='__main__')
+        else:
+            profiler.runcall(
+                runpy.run_path,
+                opts.SCRIPT,
+                run_name='__main__')
+    finally:
+        timer.uninstall()
+        with open(opts.TIMES_JSON, 'w') as f:
+            json.dump(timer.times, f, indent=2, sort_keys=True)
+        if profiler is not None:
+            save_profile(profiler, opts.PROFILE, opts.REWRITE)
+
+
+class Timer (object):
+    """Time each test from its startTest to its matching stopTest.
+
+    Under trial --jobs, the DistReporter starts each test as a worker
+    picks it up, then replays all of its calls to the real reporter when
+    the test stops, so those calls nest within its own.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self._running = {}
+        self._patched = []
+
+    def install(self):
+        from twisted.trial.reporter import TestResult
+
+        self._patch(TestResult)
+        try:
+            from twisted.trial._dist.distreporter import DistReporter
+        except ImportError:
+            pass
+        else:
+            self._patch(DistReporter)
+
+    def uninstall(self):
+        for (cls, startTest, stopTest) in self._patched:
+            cls.startTest = startTest
+            cls.stopTest = stopTest
+        self._patched = []
+
+    def _patch(self, cls):
+        startTest = cls.__dict__['startTest']
+        stopTest = cls.__dict__['stopTest']
+        self._patched.append((cls, startTest, stopTest))
+        timer = self
+
+        def timedStartTest(result, test):
+            timer._start(test.id())
+            return startTest(result, test)
+
+        def timedStopTest(result, test):
+            try:
+                return stopTest(result, test)
+            finally:
+                timer._stop(test.id())
+
+        cls.startTest = timedStartTest
+        cls.stopTest = timedStopTest
+
+    def _start(self, testid):
+        (started, depth) = self._running.get(testid, (time.time(), 0))
+        self._running[testid] = (started, depth + 1)
+
+    def _stop(self, testid):
+        (started, depth) = self._running.pop(testid, (None, 0))
+        if depth > 1:
+            self._running[testid] = (started, depth - 1)
+        elif started is not None:
+            self.times[testid] = time.time() - started
+
+
+def save_profile(profiler, prefix, rewrite=None):
+    stats = pstats.Stats(profiler).stats
+    if rewrite is not None:
+        stats = _rewrite_stats(stats, *rewrite)
+
+    dump = pstats.Stats(profiler)
+    dump.stats = stats
+    dump.dump_stats(prefix + '.pstats')
+
+    with open(prefix + '.collapsed', 'w') as f:
+        for (stack, seconds) in sorted(collapse(stats).items()):
+            micros = int(seconds * 1e6)
+            if micros > 0:
+                f.write('{} {}\n'.format(stack, micros))
+
+
+def collapse(stats):
+    """Approximate collapsed call stacks from `stats`, with their seconds.
+
+    cProfile only records caller to callee edges, so a function's own
+    time is split among the stacks reaching it in proportion to the time
+    spent in each of those edges. Recursion is cut off at its first
+    repetition.
+    """
+    callees = {}
+    for (func, (_, _, _, _, callers)) in stats.items():
+        for (caller, edge) in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    roots = [f for (f, entry) in stats.items() if not entry[4]]
+    total = sum(stats[f][3] for f in roots)
+    minimum = total * _MIN_STACK_SHARE
+
+    collapsed = {}
+    pending = [(f, (_label(f),), frozenset([f]), 1.0) for f in roots]
+    while pending:
+        (func, path, onpath, share) = pending.pop()
+        (_, _, tottime, cumtime, _) = stats[func]
+        if tottime * share > 0:
+            stack = ';'.join(path)
+            collapsed[stack] = collapsed.get(stack, 0) + tottime * share
+
+        for (callee, edgetime) in callees.get(func, ()):
+            calleetime = stats[callee][3]
+            if callee in onpath or calleetime <= 0:
+                continue
+            if edgetime * share < minimum:
+                continue
+            pending.append((
+                callee,
+                path + (_label(callee),),
+                onpath | frozenset([callee]),
+                share * edgetime / calleetime))
+
+    return collapsed
+
+
+def _rewrite_stats(stats, regex, repl):
+    rgx = re.compile(regex)
+
+    def rewrite(func):
+        (filename, line, name) = func
+        return (rgx.sub(lambda m: repl, filename), line, name)
+
+    return dict(
+        (rewrite(func),
+         (cc, nc, tt, ct,
+          dict((rewrite(c), e) for (c, e) in callers.items())))
+        for (func, (cc, nc, tt, ct, callers)) in stats.items())
+
+
+def _label(func):
+    (filename, line, name) = func
+    if filename == '~':
+        # A builtin, such as <method 'sort' of 'list' objects>:
+        label = name
+    else:
+        label = '{}:{}({})'.format(filename, line, name)
+    return label.replace(';', ':')
+
+
+if __name__ == '__main__':
+    main()
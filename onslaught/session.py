@@ -1,9 +1,29 @@
 import re
+import sys
+import copy
+import json
+import contextlib
+import time
+import errno
 import logging
+import threading
 from sys import executable as python_executable
+from onslaught.analyzers import Rewriter, Tail, TrialProgress, Writer
+from onslaught.cache import DefaultCache, content_key
+from onslaught.check_sdist_log import WarningFilter
 from onslaught.consts import DateFormat, ExitUserFail
-from onslaught import io
-from onslaught.path import Path
+from onslaught import io, pkgname
+from onslaught.path import Home, Path
+from onslaught.scripts import coverage_report, testmap, testtimes
+
+
+# Run by the target virtualenv's python, which cannot import onslaught:
+_COVERAGE_REPORT_SCRIPT = Path.from_relative(
+    re.sub(r'\.pyc$', '.py', coverage_report.__file__))
+_TESTMAP_SCRIPT = Path.from_relative(
+    re.sub(r'\.pyc$', '.py', testmap.__file__))
+_TESTTIMES_SCRIPT = Path.from_relative(
+    re.sub(r'\.pyc$', '.py', testtimes.__file__))
 
 
 class Session (object):
@@ -12,14 +32,92 @@ class Session (object):
         'coverage == 4.0.3',
     ]
 
-    def __init__(self):
+    # Kept out of the target snapshot; see `IOProvider.synctree`:
+    _SNAPSHOT_EXCLUDES = [
+        '.bzr',
+        '.git',
+        '.hg',
+        '.svn',
+        '*.egg-info',
+        '/.tox',
+        '/build',
+    ]
+
+    # Installed into the virtualenv so that coverage follows trial's
+    # worker processes; it only acts when COVERAGE_PROCESS_START is set:
+    _COVERAGE_PTH = 'import coverage; coverage.process_startup()\n'
+
+    # Part of the cached venv key, so entries whose 'complete' marker was
+    # still empty, rather than their build path, are never reused:
+    _VENV_CACHE_FORMAT = 'complete=buildpath'
+
+    # Old results are moved in here, inside the results directory so the
+    # move is a rename, then deleted while the new run proceeds:
+    _TRASH_DIR = '.trash'
+
+    # Read for the package name, before falling back to running setup.py:
+    _SETUP_FILES = ['setup.py', 'setup.cfg', 'pyproject.toml']
+
+    # Directories which flake8 never descends into:
+    _FLAKE8_DEFAULT_EXCLUDES = [
+        '.svn', 'CVS', '.bzr', '.hg', '.git', '__pycache__',
+        '.tox', '.nox', '.eggs', '*.egg',
+    ]
+
+    # Target files which may configure flake8:
+    _FLAKE8_CONFIGS = ['setup.cfg', 'tox.ini', '.flake8']
+
+    # Files per flake8 command, to keep its command line within ARG_MAX:
+    _FLAKE8_CHUNK_FILES = 500
+
+    # How much of a failed command's output is shown:
+    _FAILURE_TAIL_LINES = 200
+
+    # With `fast`, the test map is refreshed by a full run this often:
+    _FAST_REFRESH_RUNS = 20
+
+    # How many of the slowest tests the unittests phase lists:
+    _SLOWEST_TESTS = 10
+
+    def __init__(self,
+                 cache=DefaultCache,
+                 failfast=False,
+                 jobs=1,
+                 testjobs=1,
+                 fast=False,
+                 fastrefresh=False,
+                 timeout=None,
+                 profile=False,
+                 pythons=()):
         self._log = logging.getLogger(type(self).__name__)
+        self._cache = cache
+        self._failfast = failfast
+        self._jobs = jobs
+        self._testjobs = testjobs
+        self._fast = fast or fastrefresh
+        self._fastrefresh = fastrefresh
+        self._timeout = timeout
+        self._profile = profile
+        self._pythons = list(pythons)
+        self._cancelled = threading.Event()
+
+        # The interpreter to test with, which `initialize` may change:
+        self._python = python_executable
+        self._pyversion = sys.version
+        self._label = None
+        self._installed = False
 
     def initialize(self, target, resultstmpl):
         """Perform IO necessary to setup onslaught results directory."""
         self._realtarget = Path.from_relative(target)
+        self._changed = set()
 
         self._pkgname = self._init_packagename()
+        self._venvpathrgx = re.compile(
+            r'/[/a-z0-9._-]+/site-packages/{}'.format(
+                re.escape(self._pkgname),
+            ),
+        )
 
         results = Path.from_relative(
             resultstmpl.format(package=self._pkgname))
@@ -27,11 +125,139 @@ class Session (object):
         self._resdir = self._init_results_dir(results)
         self._target = self._init_target()
         self._logdir = self._init_logdir()
+        self._logrel = ['logs']
+        self._pyresdir = self._resdir
+
+        if len(self._pythons) == 1:
+            self._use_python(self._pythons[0])
 
         self._logstep = 0
+        self._lock = threading.Lock()
+        self._logfiles = {}
+        self._cachedphases = set()
+        self._manifest = {
+            'package': self._pkgname,
+            'target': self._realtarget.pathstr,
+            'python': self._python,
+            'started': time.strftime(DateFormat),
+            'commands': [],
+        }
         self._vbin = self._resdir('venv', 'bin')
+        self._sdist = None
+        self._main = self
+        self.interpreters = self._init_interpreters()
         return self
 
+    @property
+    def failfast(self):
+        """Whether to stop at the first failing test."""
+        return self._failfast
+
+    @property
+    def label(self):
+        """This interpreter's label in a matrix run, or None."""
+        return self._label
+
+    def phase_name(self, phase):
+        """Name `phase` for this interpreter, within a matrix run."""
+        if self._label is None:
+            return phase
+        else:
+            return '{}[{}]'.format(phase, self._label)
+
+    def refresh_target(self):
+        """Sync the target snapshot; return the changed relative paths."""
+        changed = self._realtarget.synctree(
+            self._target,
+            self._SNAPSHOT_EXCLUDES)
+
+        self._log.debug(
+            'Synced %d changed entries to target snapshot %r',
+            len(changed),
+            self._target)
+        self._changed.update(changed)
+        return changed
+
+    def target_mtimes(self):
+        """Map the target's relative paths to their mtimes.
+
+        This only stats the target, unlike `refresh_target`, which also
+        compares the snapshot, so it is the cheaper check for changes.
+        """
+        return dict(
+            (relpath, entry.stat(follow_symlinks=False).st_mtime)
+            for (relpath, entry) in self._realtarget.scantree(
+                self._SNAPSHOT_EXCLUDES))
+
+    def invalidated_phases(self, changed):
+        """Return the phases which a change to `changed` paths makes stale.
+
+        Dependent phases are not included.
+        """
+        phases = set()
+        if any(p.endswith('.py') for p in changed):
+            phases.add('flake8')
+
+        sdistdirs = self._sdist_directories()
+        if any(_affects_sdist(p, sdistdirs) for p in changed):
+            phases.add('setup-sdist')
+
+        return phases
+
+    def cancel(self):
+        """Kill all running commands, and refuse to start new ones."""
+        self._cancelled.set()
+        io.provider.cancel_running()
+
+    def reset_cancel(self):
+        """Allow commands to run again after `cancel`."""
+        self._cancelled.clear()
+
+    def reset_manifest(self):
+        """Start a new run.json, which records only the commands to come.
+
+        The interpreter views share the manifest, so it is reset in place.
+        """
+        with self._lock:
+            self._manifest['started'] = time.strftime(DateFormat)
+            del self._manifest['commands'][:]
+
+    def coverage_total(self):
+        """The percentage covered in the last coverage report, or None."""
+        covjson = self._pyresdir('coverage.json')
+        if not covjson.exists:
+            return None
+        return json.loads(covjson.read())['total']['percent_covered']
+
+    def run_summary(self):
+        """Return the facts about this run which the history keeps.
+
+        A matrix run is as well covered as its worst interpreter.
+        """
+        totals = [py.coverage_total() for py in self.interpreters]
+        coverage = None if None in totals else min(totals)
+
+        return {
+            'package': self._pkgname,
+            'target': self._manifest['target'],
+            'python': ' '.join(py._python for py in self.interpreters),
+            'started': self._manifest['started'],
+            'mode': self._run_mode(),
+            'jobs': self._jobs,
+            'testjobs': self._testjobs,
+            'coverage': coverage,
+        }
+
+    def cached_phases(self):
+        """The names of the phases which reused a cached result."""
+        return set(self._cachedphases)
+
+    def close(self):
+        """Detach and close this session's main.log handler."""
+        logging.getLogger().removeHandler(self._loghandler)
+        self._loghandler.close()
+        self._loghandler.stream.close()
+
     def pushd_workdir(self):
         """chdir to a 'workdir' to keep caller cwd and target dir clean."""
         workdir = self._resdir('workdir')
@@ -39,116 +265,626 @@ class Session (object):
         return workdir.pushd()
 
     def prepare_virtualenv(self):
+        """Clone a cached venv with the test utilities into the results."""
         self._log.debug('Preparing virtualenv.')
-        self._run('virtualenv', 'virtualenv', self._resdir('venv'))
+        entry = self._virtualenv_entry()
 
-    def install_test_utility_packages(self):
-        for spec in self._TEST_DEPENDENCIES:
-            name = spec.split()[0]
-            logname = 'pip-install.{}'.format(name)
-            self._install(logname, spec)
+        complete = entry('complete')
+        if complete.exists:
+            self._log.debug('Reusing cached virtualenv: %r', entry)
+        else:
+            self._build_cached_virtualenv(entry)
+
+        venv = self._pyresdir('venv')
+        venv.rmtree()
+        self._installed = False
+        if not self._claim_spare_virtualenv(entry, venv):
+            entry('venv').copytree(venv)
+        self._relocate_virtualenv(complete.read(), venv)
+
+    def fill_spare_virtualenvs(self, count):
+        """Clone the cached venv ahead of time, until `count` are spare.
+
+        `prepare_virtualenv` moves a spare clone into place rather than
+        copying one. This needs no `initialize`, and does nothing until a
+        session has built the cached venv. Returns how many were made.
+        """
+        entry = self._virtualenv_entry()
+        if not entry('complete').exists:
+            return 0
+
+        # Clean up after fills which were killed mid-copy:
+        for p in entry:
+            if p.basename.startswith('spare.'):
+                pid = int(p.basename.split('.')[1])
+                if not io.provider.is_running(pid):
+                    p.rmtree()
+
+        spares = entry('spares')
+        spares.ensure_is_directory()
+        made = 0
+        while len(spares.listdir()) < count:
+            name = '{}.{}'.format(io.provider.getpid(), made)
+            staging = entry('spare.' + name)
+            entry('venv').copytree(staging)
+            staging.rename(spares(name))
+            made += 1
+
+        return made
 
     def generate_coverage_reports(self):
-        nicerepdir = self._resdir('coverage')
-        self._log.info('Generating HTML coverage reports in: %r', nicerepdir)
+        repdir = self._pyresdir('coverage')
+        self._log.info('Generating HTML coverage reports in: %r', repdir)
+        repdir.rmtree()
 
-        rawrepdir = self._resdir('coverage.orig')
-        self._run(
-            'coverage-report-html',
-            self._vbin('coverage'),
-            'html',
-            '--directory', rawrepdir)
+        datafile = self._coverage_data_file()
+        if not datafile.exists:
+            self._log.info('No coverage data, since no tests ran.')
+            return
 
-        self._log.debug(
-            'Editing coverage report paths %r -> %r',
-            rawrepdir,
-            nicerepdir)
+        logpath = self._run(
+            'coverage-report',
+            self._vbin('python'),
+            _COVERAGE_REPORT_SCRIPT,
+            '--data-file', datafile,
+            '--html-dir', repdir,
+            '--json', self._pyresdir('coverage.json'))
 
-        self._simplify_coverage_paths(rawrepdir, nicerepdir)
-        self._display_coverage_to_stdout()
+        self._log.info('Coverage:\n%s', logpath.read())
 
     # User test phases:
     def run_phase_flake8(self):
-        self._run_phase('flake8', 'flake8', self._realtarget)
+        # Each file's diagnostics are cached, with their paths relative
+        # to the target, and keyed by everything which affects them:
+        keyparts = self._flake8_key_parts()
+        entries = {}
+        for relpath in self._flake8_files():
+            entries[relpath] = self._cache.entry(
+                'flake8',
+                *(keyparts + [relpath, self._realtarget(relpath).read()]))
 
-    def run_sdist_phases(self):
-        sdist, sdistlog = self._run_phase_setup_sdist()
+        misses = sorted(p for (p, e) in entries.iteritems() if not e.exists)
+        self._log.debug(
+            'flake8 results are cached for %d of %d files.',
+            len(entries) - len(misses),
+            len(entries))
+        if misses:
+            self._flake8_lint(misses, entries)
 
-        self._run_phase(
-            'check-sdist-log',
-            'onslaught-check-sdist-log',
-            sdistlog)
+        diagnostics = []
+        for relpath in sorted(entries):
+            abspath = self._realtarget(relpath).pathstr
+            for line in entries[relpath].read().splitlines(True):
+                if line.startswith(relpath + ':'):
+                    line = abspath + line[len(relpath):]
+                diagnostics.append(line)
 
-        self._run_phase(
-            'install-sdist',
-            self._vbin('pip'),
-            '--verbose',
-            'install',
-            sdist)
+        self._check_phase('flake8', diagnostics)
 
-    def _run_phase_setup_sdist(self):
+    def run_phase_setup_sdist(self):
         setup = self._target('setup.py')
         distdir = self._resdir('dist')
+        distdir.rmtree()
         distdir.ensure_is_directory()
 
-        # If you run setup.py sdist from a different directory, it
-        # happily creates a tarball missing the source. :-<
-        with self._target.pushd():
+        # The check-sdist-log phase reports what this catches in flight:
+        self._sdistwarnings = WarningFilter()
 
-            sdistlog = self._run_phase(
+        # Built sdists are cached by everything in the snapshot:
+        self._sdistentry = self._cache.entry(
+            'sdists',
+            python_executable,
+            sys.version,
+            self._target.treehash(self._SNAPSHOT_EXCLUDES))
+
+        if self._sdistentry('complete').exists:
+            self._reuse_cached_sdist(distdir)
+        else:
+            # Onslaught's own python builds the sdist, so this need not
+            # wait for a venv; build-wheel reruns setup.py in the venv.
+            # If you run setup.py sdist from a different directory, it
+            # happily creates a tarball missing the source. :-<
+            logpath = self._run_phase(
                 'setup-sdist',
-                self._vbin('python'),
+                python_executable,
                 setup,
                 'sdist',
                 '--dist-dir',
-                distdir)
+                distdir,
+                cwd=self._target,
+                analyzers=[self._sdistwarnings])
 
-        # Additionally, setup.py sdist has rudely pooped an egg-info
-        # directly into the source directory, so clean that up:
+            # Additionally, setup.py sdist has rudely pooped an egg-info
+            # directly into the source directory, so clean that up:
 
-        [sdist] = distdir.listdir()
-        self._log.debug('Generated sdist: %r', sdist)
-        return sdist, sdistlog
+            self._cache_sdist(distdir, logpath)
 
-    def run_phase_unittest(self):
+        [self._sdist] = distdir.listdir()
+        self._log.debug('Generated sdist: %r', self._sdist)
 
-        def filterlog(rawlogpath):
-            logpath = rawlogpath.parent(rawlogpath.basename + '.patched')
-            logpath.write(
-                self._replace_venv_paths(
-                    rawlogpath.read(),
-                    self._realtarget.pathstr))
-            return logpath
+    def _reuse_cached_sdist(self, distdir):
+        entry = self._sdistentry
+        self._log.debug('Reusing cached sdist: %r', entry)
+
+        # Replay the original log, so check-sdist-log still sees it:
+        (_, logpath) = self._new_log('phase.setup-sdist')
+        entry('setup-sdist.log').copyfile(logpath)
+        for line in logpath.read().splitlines(True):
+            self._sdistwarnings.feed(line)
+
+        for cached in entry('dist'):
+            cached.copyfile(distdir(cached.basename))
+
+        self._cachedphases.add(self.phase_name('setup-sdist'))
+        self._log.info(
+            '%s - passed (cached).',
+            self._phase_log_prefix('setup-sdist'))
+
+    def _cache_sdist(self, distdir, logpath):
+        with self._cache_staging(self._sdistentry) as staging:
+            distdir.copytree(staging('dist'))
+            logpath.copyfile(staging('setup-sdist.log'))
+            staging('complete').write('')
+
+    def _sdist_directories(self):
+        # Directories of the target which the last sdist drew from, or
+        # None if there is no sdist yet:
+        if self._sdist is None:
+            return None
+
+        dirs = set()
+        for name in self._sdist.tarnames():
+            # Strip the '{name}-{version}/' prefix:
+            parts = name.split('/', 1)
+            if len(parts) == 2:
+                dirs.add(io.provider.dirname(parts[1]))
+        return dirs
+
+    def run_phase_check_sdist_log(self):
+        self._check_phase('check-sdist-log', self._sdistwarnings.warnings)
+
+    def run_phase_build_wheel(self):
+        # A wheel built from the sdist is cached alongside it, so the
+        # sdist is only built from source once:
+        wheels = self._wheels_entry()
+        if wheels.exists:
+            self._cachedphases.add(self.phase_name('build-wheel'))
+            self._log.info(
+                '%s - passed (cached).',
+                self._phase_log_prefix('build-wheel'))
+        else:
+            with self._cache_staging(wheels) as staging:
+                self._run_phase(
+                    'build-wheel',
+                    self._vbin('pip'),
+                    '--verbose',
+                    'wheel',
+                    '--no-deps',
+                    '--wheel-dir', staging,
+                    self._main._sdist)
+
+        [cached] = wheels.listdir()
+        self._wheel = self._pyresdir('dist', cached.basename)
+        cached.copyfile(self._wheel)
+        self._log.debug('Built wheel: %r', self._wheel)
+
+    def run_phase_install_sdist(self):
+        # pip skips a wheel whose version is already installed, so a
+        # rerun into the same venv, as when watching, removes the last
+        # install first, while any new dependencies still get installed:
+        if self._installed:
+            self._run(
+                'pip-uninstall',
+                self._vbin('pip'),
+                '--verbose',
+                'uninstall',
+                '--yes',
+                self._pkgname)
 
         self._run_phase(
-            'unittests',
+            'install-sdist',
+            self._vbin('pip'),
+            '--verbose',
+            'install',
+            self._wheel)
+        self._installed = True
+
+    def run_phase_unittest(self):
+        logpref = self._phase_log_prefix('unittests')
+
+        def report(run, failed):
+            self._log.info(
+                '%s - %d tests run, %d failed so far...',
+                logpref,
+                run,
+                failed)
+
+        # Every test process, including trial's workers, writes its own
+        # coverage data file next to the final one, to be combined:
+        datafile = self._coverage_data_file()
+        for path in datafile.parent:
+            if path.basename.startswith(datafile.basename):
+                path.rmtree()
+
+        rcfile = self._pyresdir('coveragerc')
+        rcfile.write(
+            '[run]\n'
+            'branch = True\n'
+            'parallel = True\n'
+            'source = {}\n'
+            'data_file = {}\n'
+            .format(self._pkgname, datafile.pathstr))
+
+        trial = [self._vbin('trial')]
+        if self._testjobs > 1:
+            trial.extend(['--jobs', str(self._testjobs)])
+        tests = [self._pkgname]
+        mappath = None
+
+        if self._fast:
+            selected = self._select_tests()
+            if selected is None:
+                # Recording the map needs every test in this process:
+                mappath = self._resdir('testmap.json')
+                trial = [_TESTMAP_SCRIPT, mappath]
+            elif selected:
+                tests = selected
+            else:
+                self._log.info(
+                    '%s - skipped, no tests are affected.',
+                    logpref)
+                self._save_test_map(None)
+                return
+
+        timesjson = self._pyresdir('workdir', 'testtimes.json')
+        timer = [_TESTTIMES_SCRIPT, timesjson]
+        if self._profile:
+            timer.extend([
+                '--profile', self._pyresdir('profile'),
+                '--rewrite',
+                self._venvpathrgx.pattern,
+                self._venv_path_repl(self._realtarget.pathstr)])
+
+        try:
+            self._run_phase(
+                'unittests',
+                self._vbin('coverage'),
+                'run',
+                '--rcfile', rcfile,
+                *(timer + trial + tests),
+                cwd=self._pyresdir('workdir'),
+                env={'COVERAGE_PROCESS_START': rcfile.pathstr},
+                rewrite=lambda line: self._replace_venv_paths(
+                    line,
+                    self._realtarget.pathstr),
+                analyzers=[TrialProgress(report, failfast=self._failfast)]
+            )
+        finally:
+            self._report_test_times(timesjson)
+
+        self._run(
+            'coverage-combine',
             self._vbin('coverage'),
-            'run',
-            '--branch',
-            '--source', self._pkgname,
-            self._vbin('trial'),
-            self._pkgname,
-            filterlog=filterlog,
-        )
+            'combine',
+            '--rcfile', rcfile)
+
+        if self._fast:
+            self._save_test_map(mappath)
 
     # Private below:
+    def _run_mode(self):
+        # Durations are only comparable between runs of the same mode:
+        if self._fast:
+            return 'fast'
+        elif self._profile:
+            return 'profile'
+        else:
+            return 'full'
+
+    def _report_test_times(self, timesjson):
+        """List the slowest tests, and keep their times by the phase log."""
+        if not timesjson.exists:
+            # The tests were killed, or never started:
+            return
+
+        logpref = self._phase_log_prefix('unittests')
+        try:
+            times = json.loads(timesjson.read())
+        except ValueError as e:
+            # The tests were killed while the times were being written:
+            self._log.warn(
+                '%s - no test times, %r is unreadable: %s',
+                logpref,
+                timesjson,
+                e)
+            return
+        slowest = sorted(times.items(), key=lambda kv: (-kv[1], kv[0]))
+        if slowest:
+            self._log.info(
+                '%s - slowest of %d tests:\n%s',
+                logpref,
+                len(times),
+                ''.join(
+                    '{:9.3f}s  {}\n'.format(secs, testid)
+                    for (testid, secs) in slowest[:self._SLOWEST_TESTS]))
+
+        logfile = self._logfiles['phase.unittests']
+        timesjson.rename(self._logdir(re.sub(
+            r'\.log$',
+            '.times.json',
+            logfile)))
+
+        if self._profile:
+            self._log.info(
+                '%s - profile saved in %r and %r.',
+                logpref,
+                self._pyresdir('profile.pstats'),
+                self._pyresdir('profile.collapsed'))
+
+    def _flake8_key_parts(self):
+        # Under python 2, flake8 writes its --version to stderr:
+        parts = [self._run('flake8-version', 'flake8', '--version').read()]
+        configs = [self._realtarget(n) for n in self._FLAKE8_CONFIGS]
+        configs.append(Home('.config', 'flake8'))
+        for config in configs:
+            parts.append(config.read() if config.exists else '')
+        return parts
+
+    def _flake8_files(self):
+        """The target's relative .py paths, minus flake8's defaults.
+
+        The target's own excludes are left for flake8 to apply.
+        """
+        def ispy(entry):
+            return entry.name.endswith('.py') and not entry.is_dir()
+
+        return [
+            relpath for (relpath, _) in self._realtarget.scantree(
+                self._FLAKE8_DEFAULT_EXCLUDES,
+                include=ispy)
+        ]
+
+    def _flake8_lint(self, relpaths, entries):
+        # Nothing is cached unless every chunk's output is accounted for:
+        outputs = {}
+        for i in range(0, len(relpaths), self._FLAKE8_CHUNK_FILES):
+            chunk = relpaths[i:i + self._FLAKE8_CHUNK_FILES]
+            outputs.update(self._flake8_lint_chunk(chunk))
+
+        for (relpath, lines) in outputs.iteritems():
+            entries[relpath].parent.ensure_is_directory()
+            entries[relpath].write(''.join(lines))
+
+    def _flake8_lint_chunk(self, relpaths):
+        """Lint `relpaths`, returning the output lines for each of them."""
+        args = ['flake8']
+        if self._jobs > 1:
+            args.extend(['--jobs', str(self._jobs)])
+        args.extend(self._realtarget(p) for p in relpaths)
+
+        try:
+            logpath = self._run('flake8', *args)
+            tail = None
+        except io.CalledProcessError as e:
+            # flake8 exits with 1 when it reports any diagnostics, but
+            # also when it crashes:
+            if e.returncode != 1:
+                self._fail_flake8(e.tail)
+            (logpath, tail) = (e.logpath, e.tail)
+
+        byabspath = dict((self._realtarget(p).pathstr, p) for p in relpaths)
+        outputs = dict((p, []) for p in relpaths)
+        unattributed = False
+        current = None
+        for line in logpath.read().splitlines(True):
+            abspath = line.split(':', 1)[0]
+            if abspath in byabspath:
+                current = byabspath[abspath]
+                line = current + line[len(abspath):]
+            if current is None:
+                self._log.debug('Unattributed flake8 output: %r', line)
+                unattributed = True
+            else:
+                outputs[current].append(line)
+
+        # A failure which no file accounts for is a crash, such as a
+        # traceback, and caching would record every file as clean:
+        if tail is not None and (unattributed or not any(outputs.values())):
+            self._fail_flake8(tail)
+
+        return outputs
+
+    def _fail_flake8(self, tail):
+        self._log.warn(
+            '%s - FAILED:\n%s',
+            self._phase_log_prefix('flake8'),
+            ''.join(tail.lines))
+        raise SystemExit(ExitUserFail)
+
+    def _select_tests(self):
+        """Return the test modules affected by the pending changes.
+
+        Changes stay pending in the test map state until a run passes.
+        None means all tests must run to refresh the map.
+        """
+        state = self._load_test_map()
+        pending = set(state['pending']) | self._changed
+        state['pending'] = sorted(pending)
+        self._test_map_path().write(json.dumps(state))
+        self._changed = set()
+
+        sdistdirs = self._sdist_directories()
+        changed = set(p for p in pending if _affects_sdist(p, sdistdirs))
+        mapped = set()
+        for files in state['tests'].itervalues():
+            mapped.update(files)
+
+        # Besides code, files within packages may be package data:
+        mappeddirs = set(io.provider.dirname(f) for f in mapped)
+        unmapped = sorted(
+            p for p in changed
+            if (p.endswith('.py') or io.provider.dirname(p) in mappeddirs)
+            and (p not in mapped or not self._target(p).exists))
+
+        if self._fastrefresh:
+            self._fastrefresh = False
+            reason = 'as requested'
+        elif not state['tests']:
+            reason = 'there is no test map yet'
+        elif state['fastruns'] >= self._FAST_REFRESH_RUNS:
+            reason = 'after {} fast runs'.format(state['fastruns'])
+        elif unmapped:
+            reason = 'unmapped changes to {}'.format(', '.join(unmapped))
+        else:
+            selected = sorted(
+                m for (m, files) in state['tests'].iteritems()
+                if changed.intersection(files))
+            self._log.info(
+                'Selected %d of %d test modules affected by %d changes.',
+                len(selected),
+                len(state['tests']),
+                len(changed))
+            return selected
+
+        self._log.info(
+            'Running all tests to refresh the test map, %s.',
+            reason)
+        return None
+
+    def _save_test_map(self, mappath):
+        """Record a passing run, with a new test map from `mappath`."""
+        state = self._load_test_map()
+        state['pending'] = []
+        if mappath is None:
+            state['fastruns'] += 1
+        else:
+            state['tests'] = json.loads(mappath.read())
+            state['fastruns'] = 0
+        self._test_map_path().write(json.dumps(state))
+
+    def _load_test_map(self):
+        path = self._test_map_path()
+        if path.exists:
+            return json.loads(path.read())
+        else:
+            path.parent.ensure_is_directory()
+            return {'tests': {}, 'pending': [], 'fastruns': 0}
+
+    def _test_map_path(self):
+        entry = self._cache.entry('testmaps', self._realtarget.pathstr)
+        return entry('state.json')
+
+    def _coverage_data_file(self):
+        return self._pyresdir('workdir', '.coverage')
+
     def _init_packagename(self):
-        setup = self._realtarget('setup.py').pathstr
-        return io.provider.gather_output(
+        sources = []
+        for name in self._SETUP_FILES:
+            path = self._realtarget(name)
+            sources.append(path.read() if path.exists else None)
+
+        name = pkgname.static_name(*sources)
+        if name is not None:
+            self._log.debug('Read package name %r from setup files.', name)
+            return name
+
+        # Only running setup.py tells, so remember its answer:
+        entry = self._cache.entry(
+            'pkgnames',
+            python_executable,
+            *[src or '' for src in sources])
+        if entry('name').exists:
+            return entry('name').read()
+
+        name = io.provider.gather_output(
             python_executable,
-            setup,
-            '--name')
+            self._realtarget('setup.py').pathstr,
+            '--name',
+            timeout=self._timeout)
+        with self._cache_staging(entry) as staging:
+            staging('name').write(name)
+        return name
 
     def _init_results_dir(self, results):
         self._log.info('Preparing results directory: %r', results)
-        results.rmtree()
         results.ensure_is_directory()
+
+        # The previous target snapshot is kept for an incremental sync:
+        trash = results(self._TRASH_DIR)
+        stale = [
+            p for p in results
+            if p.basename not in ('targetsrc', self._TRASH_DIR)
+        ]
+        if stale:
+            binpath = trash('{}.{:.6f}'.format(
+                io.provider.getpid(),
+                time.time()))
+            binpath.ensure_is_directory()
+            for p in stale:
+                p.rename(binpath(p.basename))
+
+        # This also removes any trash an interrupted run left behind:
+        if stale or trash.exists:
+            io.provider.rmtree_background(trash.pathstr)
+
         return results
 
+    def _init_interpreters(self):
+        if len(self._pythons) <= 1:
+            return [self]
+
+        interpreters = []
+        labels = set()
+        for python in self._pythons:
+            label = base = io.provider.basename(python)
+            n = 2
+            while label in labels:
+                label = '{}-{}'.format(base, n)
+                n += 1
+            labels.add(label)
+            interpreters.append(self._for_python(python, label))
+        return interpreters
+
+    def _for_python(self, python, label):
+        """Return a view of this session which tests with `python`.
+
+        The view shares this session's snapshot, sdist, main.log, and
+        manifest, but has its own venv, wheel, logs, and coverage in the
+        pythons/{label}/ results subdirectory.
+        """
+        view = copy.copy(self)
+        view._use_python(python)
+        view._label = label
+        view._pyresdir = self._resdir('pythons', label)
+        view._vbin = view._pyresdir('venv', 'bin')
+        view._logrel = ['pythons', label, 'logs']
+        view._logdir = view._pyresdir('logs')
+        view._logfiles = {}
+        for subdir in ['logs', 'dist', 'workdir']:
+            view._pyresdir(subdir).ensure_is_directory()
+        return view
+
+    def _use_python(self, python):
+        # sys.version may span lines, so it comes last:
+        (self._python, self._pyversion) = io.provider.gather_output(
+            python,
+            '-c',
+            'import sys; '
+            'sys.stdout.write(sys.executable + "\\n" + sys.version)',
+            timeout=self._timeout).split('\n', 1)
+
+    def _wheels_entry(self):
+        # The sdist entry is keyed by the python which built it, so
+        # wheels for other interpreters are kept apart:
+        if self._python == python_executable:
+            return self._main._sdistentry('wheels')
+        return self._main._sdistentry('wheels.{}'.format(
+            content_key(self._python, self._pyversion)))
+
     def _init_target(self):
-        target = self._resdir('targetsrc')
-        self._realtarget.copytree(target)
-        return target
+        self._target = self._resdir('targetsrc')
+        self.refresh_target()
+        return self._target
 
     def _init_logdir(self):
         logpath = self._resdir('logs', 'main.log')
@@ -162,29 +898,166 @@ class Session (object):
                 datefmt=DateFormat))
 
         logging.getLogger().addHandler(handler)
+        self._loghandler = handler
 
         self._log.debug('Created debug level log in: %r', logpath)
         return logdir
 
-    def _install(self, logname, spec):
+    def _install_test_utility_packages(self, vbin):
+        for spec in self._TEST_DEPENDENCIES:
+            self._install(spec.split()[0], vbin, spec)
+
+    def _install(self, name, vbin, spec):
+        wheelhouse = self._cache.root('wheelhouse')
+        filled = self._cache.entry(
+            'wheelhouse.filled',
+            self._python,
+            self._pyversion,
+            spec)
+
+        if not filled.exists:
+            # Other sessions may install from the wheelhouse meanwhile, so
+            # only whole wheels are renamed into it, before the marker:
+            self._log.info('Filling wheelhouse for %r: %r', spec, wheelhouse)
+            with self._cache_staging(filled) as staging:
+                self._run(
+                    'pip-wheel.{}'.format(name),
+                    vbin('pip'),
+                    '--verbose',
+                    'wheel',
+                    '--wheel-dir', staging,
+                    spec)
+                wheelhouse.ensure_is_directory()
+                for wheel in staging:
+                    wheel.rename(wheelhouse(wheel.basename))
+
         self._run(
-            logname,
-            self._vbin('pip'),
+            'pip-install.{}'.format(name),
+            vbin('pip'),
             '--verbose',
             'install',
+            '--no-index',
+            '--find-links', wheelhouse,
             spec)
 
+    def _build_cached_virtualenv(self, entry):
+        # The 'complete' marker records the path the venv was built at:
+        with self._cache_staging(entry) as staging:
+            baseline = staging('venv')
+
+            self._log.info('Building cached virtualenv: %r', entry)
+            self._run(
+                'virtualenv',
+                'virtualenv',
+                '--python', self._python,
+                baseline)
+            self._install_test_utility_packages(baseline('bin'))
+            self._install_coverage_pth(baseline('bin'))
+            staging('complete').write(baseline.pathstr)
+
+    def _virtualenv_entry(self):
+        return self._cache.entry(
+            'venvs',
+            self._VENV_CACHE_FORMAT,
+            self._python,
+            self._pyversion,
+            self._COVERAGE_PTH,
+            *self._TEST_DEPENDENCIES)
+
+    def _claim_spare_virtualenv(self, entry, venv):
+        spares = entry('spares')
+        if not spares.exists:
+            return False
+
+        for spare in spares:
+            try:
+                spare.rename(venv)
+            except OSError as e:
+                # Another session claimed it first, or it is on another
+                # filesystem than the results:
+                if e.errno not in (errno.ENOENT, errno.EXDEV):
+                    raise
+            else:
+                self._log.debug('Claimed spare virtualenv: %r', spare)
+                return True
+
+        return False
+
+    @contextlib.contextmanager
+    def _cache_staging(self, entry):
+        # Cache entries are built in a private staging directory which
+        # is renamed into place, so concurrent sessions never see a
+        # partial entry. A failed or cancelled build removes its staging,
+        # and those of killed sessions are removed by later builds of
+        # neighbouring entries:
+        staging = entry.parent(
+            '{}.{}'.format(entry.basename, io.provider.getpid()))
+        self._remove_dead_cache_stagings(entry)
+        staging.rmtree()
+        staging.ensure_is_directory()
+        try:
+            yield staging
+        except BaseException:
+            staging.rmtree()
+            raise
+        self._commit_cache_staging(staging, entry)
+
+    def _remove_dead_cache_stagings(self, entry):
+        if not entry.parent.exists:
+            return
+
+        for p in entry.parent:
+            pid = p.basename.rsplit('.', 1)[-1]
+            if (pid != p.basename and
+                    pid.isdigit() and
+                    not io.provider.is_running(int(pid))):
+                self._log.debug('Removing abandoned cache staging: %r', p)
+                p.rmtree()
+
+    def _commit_cache_staging(self, staging, entry):
+        try:
+            staging.rename(entry)
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            self._log.debug('Another session cached %r first.', entry)
+            staging.rmtree()
+
+    def _install_coverage_pth(self, vbin):
+        sitepackages = io.provider.gather_output(
+            vbin('python').pathstr,
+            '-c',
+            'from distutils.sysconfig import get_python_lib; '
+            'print(get_python_lib())',
+            timeout=self._timeout)
+        Path(sitepackages)('onslaught-coverage.pth').write(
+            self._COVERAGE_PTH)
+
+    def _relocate_virtualenv(self, oldprefix, new):
+        # virtualenv bakes its absolute location into script shebangs
+        # and activate scripts, so point the clone's copies at itself:
+        for script in new('bin'):
+            if script.isfile:
+                src = script.read()
+                if '\0' not in src and oldprefix in src:
+                    self._log.debug('Relocating %r', script)
+                    script.write(src.replace(oldprefix, new.pathstr))
+
     def _run_phase(self, phase, *args, **kw):
-        logpref = 'Test Phase {!r:18}'.format(phase)
+        logpref = self._phase_log_prefix(phase)
         self._log.debug('%s running...', logpref)
         try:
             logpath = self._run('phase.'+phase, *args, **kw)
+        except io.Cancelled:
+            self._log.info('%s - cancelled.', logpref)
+            raise
         except io.CalledProcessError as e:
-            (tag, path) = e.args[-1]
-            assert tag == 'logpath', repr(e.args)
-
-            with path.open('r') as f:
-                info = f.read()
+            info = ''.join(e.tail.lines)
+            if e.tail.dropped:
+                info = '... {} earlier lines in {}\n{}'.format(
+                    e.tail.dropped,
+                    e.logpath.pathstr,
+                    info)
 
             self._log.warn('%s - FAILED:\n%s', logpref, info)
             raise SystemExit(ExitUserFail)
@@ -195,63 +1068,153 @@ class Session (object):
             self._log.info('%s - passed.', logpref)
             return logpath
 
+    def _check_phase(self, phase, failures):
+        """An in-process phase which fails if there are `failures` lines."""
+        logpref = self._phase_log_prefix(phase)
+        (_, logpath) = self._new_log('phase.'+phase)
+
+        info = ''.join(failures)
+        logpath.write(info)
+
+        if failures:
+            self._log.warn('%s - FAILED:\n%s', logpref, info)
+            raise SystemExit(ExitUserFail)
+        else:
+            self._log.info('%s - passed.', logpref)
+            return logpath
+
+    def _phase_log_prefix(self, phase):
+        return 'Test Phase {!r:18}'.format(self.phase_name(phase))
+
+    def _new_log(self, logname):
+        with self._lock:
+            logfile = '{0:02}.{1}.log'.format(self._logstep, logname)
+            self._logstep += 1
+
+        return (logfile, self._logdir(logfile))
+
     def _run(self, logname, *args, **kw):
-        filterlog = kw.pop('filterlog', lambda lp: lp)
+        """Run a command, streaming its output to a log and `analyzers`.
+
+        With `rewrite`, a '.patched' copy of the log with each line
+        rewritten is also written, and returned instead of the raw log.
+        Failures, including timeouts, raise CalledProcessError with the
+        (patched) `logpath` and a `tail` of its output. Entries of `env`
+        are added to the command's environment. After `cancel`, this
+        raises Cancelled instead of running anything.
+        """
+        rewrite = kw.pop('rewrite', None)
+        cwd = kw.pop('cwd', None)
+        env = kw.pop('env', None)
+        analyzers = list(kw.pop('analyzers', []))
         assert len(kw) == 0, 'Unexpected keyword args: {!r}'.format(kw)
 
         args = [a.pathstr if isinstance(a, Path) else a for a in args]
+        if self._cancelled.is_set():
+            raise io.Cancelled(args)
+        if cwd is not None:
+            cwd = cwd.pathstr
+        if env is not None:
+            env = dict(io.provider.environ, **env)
 
-        logfile = '{0:02}.{1}.log'.format(self._logstep, logname)
-        self._logstep += 1
+        (logfile, logpath) = self._new_log(logname)
+        self._log.debug('Running: %r; cwd %r; logfile %r', args, cwd, logfile)
 
-        self._log.debug('Running: %r; logfile %r', args, logfile)
+        # The tail and patched log come first, so they still see the line
+        # on which an analyzer aborts the run:
+        tail = Tail(self._FAILURE_TAIL_LINES)
+        if rewrite is None:
+            analyzers.insert(0, tail)
+            usage = self._run_streaming(args, cwd, env, logpath, analyzers)
+        else:
+            rawlogpath = logpath
+            logpath = rawlogpath.parent(rawlogpath.basename + '.patched')
+            with logpath.open('w') as patchedf:
+                analyzers.insert(
+                    0,
+                    Rewriter(rewrite, [Writer(patchedf), tail]))
+                usage = self._run_streaming(
+                    args,
+                    cwd,
+                    env,
+                    rawlogpath,
+                    analyzers)
 
-        rawlogpath = self._logdir(logfile)
-        try:
-            with rawlogpath.open('w') as f:
-                io.provider.check_call(args, stdout=f, stderr=io.STDOUT)
-        except io.CalledProcessError as e:
-            e.args += (('logpath', filterlog(rawlogpath)),)
-            raise
+        self._record_usage(logname, args, cwd, logfile, usage)
+
+        if usage.returncode != 0:
+            e = io.CalledProcessError(usage.returncode, args)
+            e.logpath = logpath
+            e.tail = tail
+            raise e
         else:
-            return filterlog(rawlogpath)
-
-    def _simplify_coverage_paths(self, rawrepdir, nicerepdir):
-        nicerepdir.ensure_is_directory()
-
-        for srcpath in rawrepdir.walk_files():
-            dstpath = nicerepdir(srcpath.basename)
-            if srcpath.basename.endswith('.html'):
-                self._log.debug(
-                    'Tidying paths from %r -> %r',
-                    srcpath,
-                    dstpath,
-                )
-
-                src = srcpath.read()
-                dst = self._replace_venv_paths(src, '&#x2026;')
-                dstpath.write(dst)
-
-            elif srcpath.isfile:
-                srcpath.copyfile(dstpath)
-            else:
-                srcpath.copytree(dstpath)
+            return logpath
 
-    def _display_coverage_to_stdout(self):
-        logpath = self._run(
-            'coverage-report-stdout',
-            self._vbin('coverage'),
-            'report')
+    def _run_streaming(self, args, cwd, env, logpath, analyzers):
+        def feed(line):
+            for analyzer in analyzers:
+                analyzer.feed(line)
 
-        self._log.info(
-            'Coverage:\n%s',
-            self._replace_venv_paths(logpath.read(), '...'))
+        with logpath.open('w') as f:
+            return io.provider.run_with_usage(
+                args,
+                stdout=f,
+                stderr=io.STDOUT,
+                cwd=cwd,
+                env=env,
+                feed=feed,
+                timeout=self._timeout)
+
+    def _record_usage(self, logname, args, cwd, logfile, usage):
+        self._log.debug(
+            'Finished %r: status %r; wall %.2fs; user %.2fs; sys %.2fs; '
+            'maxrss %dKiB',
+            logname,
+            usage.returncode,
+            usage.wall,
+            usage.utime,
+            usage.stime,
+            usage.maxrss)
+
+        with self._lock:
+            self._logfiles[logname] = logfile
+            self._manifest['commands'].append({
+                'name': logname,
+                'args': args,
+                'cwd': cwd,
+                'log': io.provider.join(*(self._logrel + [logfile])),
+                'exitstatus': usage.returncode,
+                'wall_seconds': usage.wall,
+                'user_seconds': usage.utime,
+                'sys_seconds': usage.stime,
+                'maxrss_kib': usage.maxrss,
+            })
+            self._resdir('run.json').write(
+                json.dumps(self._manifest, indent=2, sort_keys=True))
 
     def _replace_venv_paths(self, src, repl):
-        rgx = re.compile(
-            r'/[/a-z0-9._-]+/site-packages/{}'.format(
-                re.escape(self._pkgname),
-            ),
-        )
-        realrepl = '{}/{}'.format(repl, self._pkgname)
-        return rgx.subn(realrepl, src)[0]
+        return self._venvpathrgx.sub(self._venv_path_repl(repl), src)
+
+    def _venv_path_repl(self, repl):
+        return '{}/{}'.format(repl, self._pkgname)
+
+
+def _affects_sdist(relpath, sdistdirs):
+    """Could `relpath` be in an sdist with member dirs `sdistdirs`?
+
+    A `sdistdirs` of None means there is no sdist to compare against.
+    """
+    if sdistdirs is None:
+        return True
+    d = io.provider.dirname(relpath)
+    return d in sdistdirs or bool(_ancestors(d) & sdistdirs)
+
+
+def _ancestors(relpath):
+    """The non-root ancestor directories of `relpath`."""
+    result = set()
+    while relpath:
+        relpath = io.provider.dirname(relpath)
+        if relpath:
+            result.add(relpath)
+    return result
@@ -0,0 +1,201 @@
+"""Benchmark onslaught's own overhead, apart from the tools it drives.
+
+Sessions run against synthetic target projects on the real filesystem,
+while a fake IOProvider stands in for every subprocess. Run with:
+
+    python -m onslaught.tests.benchmark [--quick]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+from onslaught import io
+from onslaught.cache import Cache
+from onslaught.path import Path
+from onslaught.session import Session
+
+
+PackageName = 'synthpkg'
+
+SitePackages = (
+    '/home/ci/.onslaught/results/{}/venv/lib/python2.7/site-packages')
+
+
+# (label, module count, lines per module, venv path text lines,
+#  log lines):
+Sizes = [
+    ('small', 10, 50, 2000, 1000),
+    ('medium', 200, 200, 10000, 20000),
+    ('large', 2000, 200, 30000, 200000),
+]
+
+QuickSizes = [
+    ('tiny', 3, 5, 50, 10),
+]
+
+
+class FakeIOProvider (io.IOProvider):
+    """Real file I/O; subprocesses are replaced by canned output."""
+
+    def __init__(self, outputlines=0):
+        io.IOProvider.__init__(self)
+        self.outputlines = outputlines
+
+    def gather_output(self, *args, **kw):
+        assert args[-1] == '--name', args
+        return PackageName
+
+    def run_with_usage(self, args, feed=None, **kw):
+        line = 'File "{}/{}/module.py", line 1, in <module>\n'.format(
+            SitePackages.format(PackageName),
+            PackageName)
+
+        stdout = kw['stdout']
+        for _ in xrange(self.outputlines):
+            stdout.write(line)
+            if feed is not None:
+                feed(line)
+
+        return io.ProcessUsage(0, 0.0, 0.0, 0.0, 0)
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--quick',
+        action='store_true',
+        help='Only run a tiny size, to check the benchmarks work.')
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Report the best of this many timings.')
+    opts = parser.parse_args(args)
+
+    sizes = QuickSizes if opts.quick else Sizes
+    for row in run_benchmarks(sizes, opts.repeat):
+        print '{:<8} {:<32} {:>10.4f}s'.format(*row)
+
+
+def run_benchmarks(sizes, repeat):
+    """Yield (size label, benchmark name, best seconds) rows."""
+    for size in sizes:
+        (label, modules, modlines, textlines, loglines) = size
+
+        with _fake_provider(loglines) as basedir:
+            target = _make_target(basedir, modules, modlines)
+            resultstmpl = os.path.join(basedir, 'results', '{package}')
+
+            def new_session():
+                cache = Cache(Path(os.path.join(basedir, 'cache')))
+                return Session(cache=cache)
+
+            def init_cold():
+                shutil.rmtree(os.path.join(basedir, 'results'), True)
+                return new_session()
+
+            def init_warm():
+                return new_session()
+
+            def initialize(s):
+                s.initialize(target, resultstmpl)
+                s.close()
+
+            yield (label, 'initialize (cold snapshot)',
+                   _best(repeat, init_cold, initialize))
+
+            yield (label, 'initialize (warm snapshot)',
+                   _best(repeat, init_warm, initialize))
+
+            s = new_session().initialize(target, resultstmpl)
+            try:
+                log = _make_venv_path_text(textlines)
+                yield (label, '_replace_venv_paths ({}KiB)'.format(
+                           len(log) // 1024),
+                       _best(repeat, lambda: None,
+                             lambda _: s._replace_venv_paths(log, '...')))
+
+                yield (label, '_run ({} log lines)'.format(loglines),
+                       _best(repeat, lambda: None,
+                             lambda _: s._run('bench', 'true')))
+
+                def rewrite(line):
+                    return s._replace_venv_paths(line, target)
+
+                yield (label, '_run with rewrite',
+                       _best(repeat, lambda: None,
+                             lambda _: s._run(
+                                 'bench', 'true', rewrite=rewrite)))
+            finally:
+                s.close()
+
+
+def _best(repeat, setup, func):
+    timings = []
+    for _ in range(repeat):
+        arg = setup()
+        start = time.time()
+        func(arg)
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+@contextlib.contextmanager
+def _fake_provider(outputlines):
+    basedir = tempfile.mkdtemp(prefix='onslaught-bench-')
+    realprovider = io.provider
+    io.provider = FakeIOProvider(outputlines)
+    try:
+        yield basedir
+    finally:
+        io.provider = realprovider
+        shutil.rmtree(basedir)
+
+
+def _make_target(basedir, modules, modlines):
+    target = os.path.join(basedir, 'target')
+    pkgdir = os.path.join(target, PackageName)
+    os.makedirs(os.path.join(target, '.git'))
+    os.makedirs(pkgdir)
+
+    _write(
+        os.path.join(target, 'setup.py'),
+        'from setuptools import setup\nsetup(name={!r})\n'.format(
+            PackageName))
+    _write(os.path.join(pkgdir, '__init__.py'), '')
+
+    body = ''.join(
+        'def f{0}(x):\n    return x + {0}\n'.format(i)
+        for i in range(modlines // 2))
+
+    for i in range(modules):
+        _write(os.path.join(pkgdir, 'mod{}.py'.format(i)), body)
+        _write(os.path.join(target, '.git', 'obj{}'.format(i)), body)
+
+    return target
+
+
+def _make_venv_path_text(lines):
+    line = (
+        '<p id="n{0}" class="pln"><a href="#n{0}">{0}</a></p> '
+        '<td class="name left"><a href="x.html">{1}/{2}/mod{0}.py'
+        '</a></td>\n'
+    )
+    sitepkgs = SitePackages.format(PackageName)
+    return ''.join(
+        line.format(n, sitepkgs, PackageName)
+        for n in range(lines))
+
+
+def _write(path, contents):
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+if __name__ == '__main__':
+    main()
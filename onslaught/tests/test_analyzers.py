@@ -0,0 +1,45 @@
+import unittest
+
+from onslaught import io
+from onslaught.analyzers import Tail, TrialProgress
+
+
+class TailTests (unittest.TestCase):
+    def test_keeps_last_lines(self):
+        tail = Tail(2)
+        for line in ['a\n', 'b\n', 'c\n']:
+            tail.feed(line)
+
+        self.assertEqual(['b\n', 'c\n'], tail.lines)
+        self.assertEqual(1, tail.dropped)
+
+
+class TrialProgressTests (unittest.TestCase):
+    Output = [
+        'foo.test_foo\n',
+        '  FooTests\n',
+        '    test_a ...                                                [OK]\n',
+        '    test_b ...                                              [FAIL]\n',
+        '    test_c ...                                           [SKIPPED]\n',
+        'Ran 3 tests in 0.01s\n',
+    ]
+
+    def test_counts(self):
+        reports = []
+        progress = TrialProgress(
+            lambda run, failed: reports.append((run, failed)),
+            interval=0)
+
+        for line in self.Output:
+            progress.feed(line)
+
+        self.assertEqual((3, 1), (progress.run, progress.failed))
+        self.assertEqual([(1, 0), (2, 1), (3, 1)], reports)
+
+    def test_failfast(self):
+        progress = TrialProgress(lambda run, failed: None, failfast=True)
+
+        self.assertRaises(
+            io.AbortRun,
+            lambda: [progress.feed(line) for line in self.Output])
+        self.assertEqual((2, 1), (progress.run, progress.failed))
@@ -0,0 +1,110 @@
+import os
+import logging
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock, patch
+
+from onslaught.batch import (
+    _Worker,
+    format_summary,
+    read_targets,
+    results_templates,
+    run_batch,
+)
+from onslaught.consts import ExitUnknownError, ExitUserFail
+
+
+class ReadTargetsTests (unittest.TestCase):
+    def test_read_targets(self):
+        tmp = tempfile.mkdtemp(prefix='onslaught-test-')
+        self.addCleanup(shutil.rmtree, tmp)
+
+        batchfile = os.path.join(tmp, 'targets.txt')
+        with open(batchfile, 'w') as f:
+            f.write('# Comment\nfoo\n\n  /abs/bar  \nfoo\n')
+
+        self.assertEqual(
+            [os.path.join(tmp, 'foo'), '/abs/bar'],
+            read_targets(batchfile))
+
+
+class ResultsTemplatesTests (unittest.TestCase):
+    def test_each_target_gets_its_own_results(self):
+        templates = results_templates(
+            '/res/{package}/',
+            ['/a/demo', '/b/demo/', '/a/t{2}'])
+
+        self.assertEqual(
+            ['/res/{package}-demo',
+             '/res/{package}-demo-2',
+             '/res/{package}-t{{2}}'],
+            [templates[t] for t in ['/a/demo', '/b/demo/', '/a/t{2}']])
+        self.assertEqual(
+            '/res/demo-t{2}',
+            templates['/a/t{2}'].format(package='demo'))
+
+
+class WorkerTests (unittest.TestCase):
+    def test_outcomes(self):
+        def runner(target):
+            if target == 'fail':
+                raise SystemExit(ExitUserFail)
+            elif target == 'error':
+                raise ValueError(target)
+
+        worker = _Worker(runner)
+
+        self.assertEqual(
+            ['passed', 'failed', 'error'],
+            [worker(t)[1] for t in ['pass', 'fail', 'error']])
+
+        (_, _, _, errtext) = worker('error')
+        self.assertIn('ValueError: error', errtext)
+
+
+class RunBatchTests (unittest.TestCase):
+    def setUp(self):
+        # run_batch reports through the 'batch' logger, which no test
+        # configures:
+        log = logging.getLogger('batch')
+        handler = logging.NullHandler()
+        log.addHandler(handler)
+        self.addCleanup(log.removeHandler, handler)
+
+    @patch('multiprocessing.Pool')
+    def test_interrupt_terminates_and_summarizes(self, m_Pool):
+        pool = m_Pool.return_value
+        pool.imap_unordered.return_value.next.side_effect = [
+            ('/a', 'passed', 1.0, None),
+            KeyboardInterrupt(),
+        ]
+
+        with patch('onslaught.batch.format_summary') as m_format_summary:
+            status = run_batch(['/a', '/b'], MagicMock(), 2)
+
+        self.assertEqual(ExitUnknownError, status)
+        pool.terminate.assert_called_once_with()
+        self.assertFalse(pool.close.called)
+        pool.join.assert_called_once_with()
+        m_format_summary.assert_called_once_with([
+            ('/a', 'passed', 1.0),
+            ('/b', 'stopped', None),
+        ])
+
+
+class FormatSummaryTests (unittest.TestCase):
+    def test_format_summary(self):
+        self.assertEqual(
+            '\n'.join([
+                'Target     Result    Duration',
+                '-----------------------------',
+                '/a/foo     passed        1.5s',
+                '/a/barbaz  failed       12.0s',
+                '/a/quux    stopped          -',
+            ]),
+            format_summary([
+                ('/a/foo', 'passed', 1.5),
+                ('/a/barbaz', 'failed', 12.0),
+                ('/a/quux', 'stopped', None),
+            ]))
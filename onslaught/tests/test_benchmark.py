@@ -0,0 +1,17 @@
+import unittest
+
+from onslaught import io
+from onslaught.tests.benchmark import QuickSizes, run_benchmarks
+
+
+class BenchmarkSmokeTest (unittest.TestCase):
+    def test_quick_benchmarks_run(self):
+        realprovider = io.provider
+
+        rows = list(run_benchmarks(QuickSizes, repeat=1))
+
+        self.assertIs(realprovider, io.provider)
+        self.assertEqual(5, len(rows))
+        for (label, name, seconds) in rows:
+            self.assertEqual('tiny', label)
+            self.assertGreaterEqual(seconds, 0.0)
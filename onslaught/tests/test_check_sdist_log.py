@@ -0,0 +1,20 @@
+import unittest
+
+from onslaught.check_sdist_log import WarningFilter
+
+
+class WarningFilterTests (unittest.TestCase):
+    def test_collects_warning_lines(self):
+        wf = WarningFilter()
+        for line in [
+                'running sdist\n',
+                'warning: sdist: standard file not found\n',
+                'writing manifest file\n',
+                'warning: check: missing required meta-data: url\n',
+                'no warning: here\n']:
+            wf.feed(line)
+
+        self.assertEqual(
+            ['warning: sdist: standard file not found\n',
+             'warning: check: missing required meta-data: url\n'],
+            wf.warnings)
@@ -0,0 +1,63 @@
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+from StringIO import StringIO
+from mock import patch
+
+from onslaught import daemon
+
+
+def _runner(args):
+    logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
+    logging.getLogger('test').warn('Running %r in %s', args, os.getcwd())
+    sys.stderr.write('caf\xe9\n')
+    raise SystemExit(3)
+
+
+def _env_runner(args):
+    sys.stdout.write('{} {}\n'.format(args[0], os.environ['ONSLAUGHT_TEST']))
+
+
+class DaemonTests (unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='onslaught-test-')
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.sockpath = os.path.join(self.tmp, 'daemon.sock')
+
+    def test_no_daemon(self):
+        self.assertIsNone(daemon.submit(['x'], self.sockpath))
+
+    def test_round_trip(self):
+        server = daemon.Server(self.sockpath, _runner, spares=0)
+        self.addCleanup(server.server_close)
+        t = threading.Thread(target=server.handle_request)
+        t.start()
+
+        with patch('sys.stdout', StringIO()) as out:
+            with patch('sys.stderr', StringIO()) as err:
+                status = daemon.submit(['--fast', 'pkg'], self.sockpath)
+        t.join(10)
+
+        self.assertEqual(3, status)
+        self.assertEqual(
+            "Running ['--fast', 'pkg'] in {}\n".format(os.getcwd()),
+            out.getvalue())
+        self.assertEqual('caf\xe9\n', err.getvalue())
+
+    def test_non_utf8_request(self):
+        server = daemon.Server(self.sockpath, _env_runner, spares=0)
+        self.addCleanup(server.server_close)
+        t = threading.Thread(target=server.handle_request)
+        t.start()
+
+        with patch.dict('os.environ', {'ONSLAUGHT_TEST': 'caf\xe9'}):
+            with patch('sys.stdout', StringIO()) as out:
+                status = daemon.submit(['caf\xe9'], self.sockpath)
+        t.join(10)
+
+        self.assertEqual(0, status)
+        self.assertEqual('caf\xe9 caf\xe9\n', out.getvalue())
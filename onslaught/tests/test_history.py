@@ -0,0 +1,114 @@
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from mock import patch
+
+from onslaught import history
+from onslaught.path import Path
+
+
+def _summary(mode='full', coverage=80.0, python='/usr/bin/python', jobs=4):
+    return {
+        'package': 'foopkg',
+        'target': '/src/foopkg',
+        'python': python,
+        'started': '2026-10-16 12:00:00',
+        'mode': mode,
+        'jobs': jobs,
+        'testjobs': 1,
+        'coverage': coverage,
+    }
+
+
+class HistoryTests (unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='onslaught-test-')
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.db = Path(self.tmp)('history', 'history.sqlite')
+        self.history = history.History(self.db.pathstr)
+
+    def _record(self, unittests, install=2.0, passed=True, cached=False,
+                **summary):
+        self.history.record(
+            _summary(**summary),
+            0 if passed else 1,
+            unittests + install,
+            [('install-sdist', install, True, cached),
+             ('unittests', unittests, passed, False)])
+
+    def test_flags_slower_phase(self):
+        for secs in [10.0, 11.0, 9.0, 10.5]:
+            self._record(secs)
+        self._record(20.0)
+
+        report = self.history.report('foopkg', 10, 10, 1.25)
+        [install, unittests] = report['phases']
+
+        self.assertEqual('unittests', unittests['name'])
+        self.assertEqual(10.25, unittests['baseline'])
+        self.assertEqual(20.0, unittests['latest'])
+        self.assertTrue(unittests['slower'])
+        self.assertFalse(install['slower'])
+        self.assertEqual(80.0, report['latest']['coverage'])
+
+    def test_baseline_ignores_failures_and_other_modes(self):
+        for secs in [10.0, 10.0, 10.0]:
+            self._record(secs)
+        self._record(1.0, passed=False)
+        self._record(1.0, mode='fast')
+        self._record(11.0)
+
+        report = self.history.report('foopkg', 10, 10, 1.25)
+        unittests = report['phases'][1]
+
+        self.assertEqual([10.0, 10.0, 10.0, None, 11.0], unittests['recent'])
+        self.assertEqual(10.0, unittests['baseline'])
+        self.assertFalse(unittests['slower'])
+
+    def test_baseline_ignores_other_pythons_and_jobs(self):
+        for secs in [10.0, 10.0, 10.0]:
+            self._record(secs)
+        self._record(1.0, python='/usr/bin/python3')
+        self._record(1.0, jobs=1)
+        self._record(20.0)
+
+        report = self.history.report('foopkg', 10, 10, 1.25)
+        unittests = report['phases'][1]
+
+        self.assertEqual([10.0, 10.0, 10.0, 20.0], unittests['recent'])
+        self.assertTrue(unittests['slower'])
+
+    def test_baseline_ignores_cached_phases(self):
+        for install in [10.0, 0.1, 0.1, 10.0, 10.0]:
+            self._record(5.0, install=install, cached=(install < 1))
+        self._record(5.0, install=0.1, cached=True)
+
+        [install, _] = self.history.report('foopkg', 10, 10, 1.25)['phases']
+
+        self.assertEqual(10.0, install['baseline'])
+        self.assertIsNone(install['latest'])
+        self.assertFalse(install['slower'])
+        self.assertIn(
+            '10.0 c c 10.0 10.0 c',
+            history.format_report(
+                self.history.report('foopkg', 10, 10, 1.25)))
+
+    def test_too_few_runs_flag_nothing(self):
+        self._record(10.0)
+        self._record(50.0)
+
+        [_, unittests] = self.history.report('foopkg', 10, 10, 1.25)['phases']
+        self.assertIsNone(unittests['baseline'])
+        self.assertFalse(unittests['slower'])
+
+    def test_main_check(self):
+        for secs in [10.0, 10.0, 10.0, 30.0]:
+            self._record(secs)
+
+        with patch('sys.stdout', StringIO()) as out:
+            status = history.main(['--check'], database=self.db)
+
+        self.assertEqual(history.ExitUserFail, status)
+        self.assertIn('foopkg: latest full run', out.getvalue())
+        self.assertIn('SLOWER', out.getvalue())
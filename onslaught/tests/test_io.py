@@ -0,0 +1,204 @@
+import os
+import time
+import shutil
+import signal
+import tempfile
+import threading
+import unittest
+from mock import patch
+
+from onslaught.io import Cancelled, IOProvider
+
+
+class SynctreeTests (unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='onslaught-test-')
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+        self.src = os.path.join(self.tmp, 'src')
+        self.dst = os.path.join(self.tmp, 'dst')
+        self.iop = IOProvider()
+
+        self._write('setup.py', 'setup()\n')
+        self._write('pkg/__init__.py', '')
+        self._write('pkg/build/module.py', 'x = 1\n')
+        self._write('build/lib/pkg/__init__.py', '')
+        self._write('.git/HEAD', 'ref\n')
+        self._write('pkg.egg-info/PKG-INFO', 'Name: pkg\n')
+        os.symlink('setup.py', os.path.join(self.src, 'link'))
+
+    def test_initial_sync(self):
+        changed = self._sync()
+
+        self.assertEqual(
+            ['link', 'pkg/__init__.py', 'pkg/build/module.py', 'setup.py'],
+            changed)
+        self.assertEqual('setup.py', os.readlink(self._dst('link')))
+        self.assertFalse(os.path.exists(self._dst('build')))
+        self.assertFalse(os.path.exists(self._dst('.git')))
+        self.assertFalse(os.path.exists(self._dst('pkg.egg-info')))
+
+    def test_resync_unchanged(self):
+        self._sync()
+        self.assertEqual([], self._sync())
+
+    def test_resync_changes(self):
+        self._sync()
+
+        self._write('setup.py', 'setup(name="pkg")\n')
+        os.remove(os.path.join(self.src, 'pkg', '__init__.py'))
+        with open(self._dst('stray.txt'), 'w') as f:
+            f.write('leftover')
+
+        self.assertEqual(
+            ['pkg/__init__.py', 'setup.py', 'stray.txt'],
+            self._sync())
+
+        with open(self._dst('setup.py')) as f:
+            self.assertEqual('setup(name="pkg")\n', f.read())
+        self.assertEqual(['build'], os.listdir(self._dst('pkg')))
+
+    def test_resync_drops_excluded_artifacts_quietly(self):
+        self._sync()
+        self.iop.ensure_is_directory(self._dst('pkg.egg-info'))
+
+        self.assertEqual([], self._sync())
+        self.assertFalse(os.path.exists(self._dst('pkg.egg-info')))
+
+    def _sync(self):
+        return self.iop.synctree(
+            self.src,
+            self.dst,
+            ['.git', '*.egg-info', '/build'])
+
+    def _dst(self, relpath):
+        return os.path.join(self.dst, relpath)
+
+    def _write(self, relpath, contents):
+        path = os.path.join(self.src, relpath)
+        self.iop.ensure_is_directory(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+
+
+class RunWithUsageTests (unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='onslaught-test-')
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.iop = IOProvider()
+        self.lines = []
+
+    def test_timeout_kills_process_group(self):
+        # The grandchild reports its pid, then outlives its parent:
+        script = 'sleep 30 & echo $!; wait'
+        start = time.time()
+        (usage, output) = self._run(['sh', '-c', script], timeout=0.5)
+
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(-signal.SIGKILL, usage.returncode)
+        self.assertIn('[onslaught] Timed out after 0.5s', output)
+        self.assertEqual(output, ''.join(self.lines))
+        self._assert_dead(int(output.split()[0]))
+
+    def test_cancel_running(self):
+        started = threading.Event()
+
+        def feed(line):
+            self.lines.append(line)
+            started.set()
+
+        def cancel():
+            started.wait(10)
+            self.iop.cancel_running()
+
+        t = threading.Thread(target=cancel)
+        t.start()
+        try:
+            self.assertRaises(
+                Cancelled,
+                self._run,
+                ['sh', '-c', 'echo started; sleep 30'],
+                feed=feed)
+        finally:
+            t.join()
+
+        self.assertEqual(['started\n'], self.lines)
+
+    def _run(self, args, feed=None, **kw):
+        path = os.path.join(self.tmp, 'out.log')
+        with open(path, 'w') as f:
+            usage = self.iop.run_with_usage(
+                args,
+                stdout=f,
+                feed=feed or self.lines.append,
+                **kw)
+        with open(path) as f:
+            return (usage, f.read())
+
+    def _assert_dead(self, pid):
+        for _ in range(100):
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                return
+            time.sleep(0.05)
+        self.fail('Process {} is still running'.format(pid))
+
+
+class RmtreeBackgroundTests (unittest.TestCase):
+    def test_removes_tree(self):
+        tmp = tempfile.mkdtemp(prefix='onslaught-test-')
+        self.addCleanup(shutil.rmtree, tmp, True)
+        iop = IOProvider()
+        iop.ensure_is_directory(os.path.join(tmp, 'a', 'b'))
+
+        iop.rmtree_background(tmp).join(10)
+
+        self.assertFalse(os.path.exists(tmp))
+
+
+class ScantreeTests (unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='onslaught-test-')
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.iop = IOProvider()
+
+        for relpath in ['b.py', 'a/x.py', 'a/y.txt', 'build/z.py']:
+            path = os.path.join(self.tmp, 'src', relpath)
+            self.iop.ensure_is_directory(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(relpath)
+        os.symlink('a', os.path.join(self.tmp, 'src', 'link'))
+
+    def test_order_exclude_and_include(self):
+        def notdir(entry):
+            return not entry.is_dir(follow_symlinks=False)
+
+        src = os.path.join(self.tmp, 'src')
+        self.assertEqual(
+            ['a', 'a/x.py', 'a/y.txt', 'b.py', 'link'],
+            [r for (r, _) in self.iop.scantree(src, ['/build'])])
+        self.assertEqual(
+            ['a/x.py', 'a/y.txt', 'b.py', 'link'],
+            [r for (r, _) in self.iop.scantree(src, ['/build'], notdir)])
+
+    def test_without_scandir(self):
+        src = os.path.join(self.tmp, 'src')
+        expected = self.iop.treehash(src)
+
+        with patch('onslaught.io.scandir', None):
+            self.assertEqual(expected, self.iop.treehash(src))
+
+    def test_copytree(self):
+        src = os.path.join(self.tmp, 'src')
+        dst = os.path.join(self.tmp, 'dst')
+        os.utime(os.path.join(src, 'b.py'), (1, 2))
+        os.chmod(os.path.join(src, 'a'), 0o555)
+        self.addCleanup(os.chmod, os.path.join(src, 'a'), 0o755)
+        self.addCleanup(os.chmod, os.path.join(dst, 'a'), 0o755)
+
+        self.iop.copytree(src, dst)
+
+        self.assertEqual(self.iop.treehash(src), self.iop.treehash(dst))
+        self.assertEqual('a', os.readlink(os.path.join(dst, 'link')))
+        self.assertEqual(2, os.stat(os.path.join(dst, 'b.py')).st_mtime)
@@ -0,0 +1,30 @@
+import unittest
+from mock import patch
+
+from onslaught import daemon
+from onslaught.main import submit_args
+
+
+class SubmitArgsTests (unittest.TestCase):
+    @patch('onslaught.daemon.submit')
+    def test_default_socket(self, m_submit):
+        m_submit.return_value = 3
+
+        self.assertEqual(3, submit_args(['--fast', 'pkg']))
+        m_submit.assert_called_once_with(
+            ['--fast', 'pkg'],
+            daemon.DefaultSocket.pathstr)
+
+    @patch('onslaught.daemon.submit')
+    def test_socket_options(self, m_submit):
+        submit_args(['--socket', '/a.sock', 'pkg'])
+        submit_args(['--socket=/b.sock', 'pkg'])
+
+        self.assertEqual(
+            ['/a.sock', '/b.sock'],
+            [args[1] for (args, _) in m_submit.call_args_list])
+
+    @patch('onslaught.daemon.submit')
+    def test_no_daemon(self, m_submit):
+        self.assertIsNone(submit_args(['--fast', '--no-daemon', 'pkg']))
+        self.assertFalse(m_submit.called)
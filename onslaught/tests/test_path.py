@@ -0,0 +1,19 @@
+import pickle
+import unittest
+
+from onslaught.path import Path
+
+
+class PathTests (unittest.TestCase):
+    def test_pickle(self):
+        p = Path('/foo/bar')
+        self.assertEqual('bar', p.basename)
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            q = pickle.loads(pickle.dumps(p, protocol))
+            self.assertEqual(p, q)
+            self.assertEqual(Path('/foo'), q.parent)
+
+    def test_parent_is_cached(self):
+        p = Path('/foo/bar')
+        self.assertIs(p.parent, p.parent)
@@ -0,0 +1,45 @@
+import unittest
+
+from onslaught.pkgname import static_name
+
+
+class StaticNameTests (unittest.TestCase):
+    def test_setuppy_literal(self):
+        self.assertEqual('foo', static_name(
+            'from setuptools import setup\n'
+            'setup(name="foo", version="0.1")\n'))
+
+    def test_setuppy_constant(self):
+        self.assertEqual('foo', static_name(
+            'import setuptools\n'
+            'PACKAGE = "foo"\n'
+            'def setup():\n'
+            '    setuptools.setup(name=PACKAGE, packages=[PACKAGE])\n'
+            'setup()\n'))
+
+    def test_setuppy_computed_name_is_unknown(self):
+        for source in [
+                'setup(name=get_name())\n',
+                'NAME = "a"\nNAME = "b"\nsetup(name=NAME)\n',
+                'setup(**metadata)\n',
+                'setup(\n',
+                ]:
+            self.assertIsNone(
+                static_name(source, '[metadata]\nname = foo\n'),
+                source)
+
+    def test_setupcfg_when_setuppy_has_no_name(self):
+        self.assertEqual('foo', static_name(
+            'setup()\n',
+            '[metadata]\nname = foo\nversion = 0.1\n'))
+
+    def test_pyproject(self):
+        self.assertEqual('foo', static_name(
+            'setup()\n',
+            '[options]\nzip_safe = False\n',
+            '[build-system]\nrequires = ["setuptools"]\n\n'
+            '[project]\nname = "foo"  # The dist name\n'
+            '\n[tool.other]\nname = "bar"\n'))
+
+    def test_nothing_found(self):
+        self.assertIsNone(static_name('setup()\n', None, '[tool.x]\n'))
@@ -0,0 +1,166 @@
+import os
+import signal
+import threading
+import unittest
+from mock import Mock, patch
+
+from onslaught import io
+from onslaught.run import (
+    _cancel_on_termination,
+    format_matrix_summary,
+    parse_args,
+    schedule_phases,
+)
+
+
+class FakeInterpreter (object):
+    def __init__(self, label, failing, log):
+        self.label = label
+        self._failing = failing
+        self._log = log
+        for phase in ['prepare_virtualenv',
+                      'run_phase_build_wheel',
+                      'run_phase_install_sdist',
+                      'run_phase_unittest',
+                      'generate_coverage_reports']:
+            setattr(self, phase, self._phase(phase))
+
+    def phase_name(self, phase):
+        return '{}[{}]'.format(phase, self.label)
+
+    def coverage_total(self):
+        return None
+
+    def _phase(self, phase):
+        def run():
+            if phase == self._failing:
+                raise SystemExit(1)
+            self._log.append((self.label, phase))
+        return run
+
+
+class FakeSession (object):
+    def __init__(self, failfast, failing):
+        self.failfast = failfast
+        self.cancelled = threading.Event()
+        self.log = []
+        self.interpreters = [
+            FakeInterpreter('py2', failing, self.log),
+            FakeInterpreter('py3', None, self.log),
+        ]
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run_phase_flake8(self):
+        pass
+
+    def run_phase_setup_sdist(self):
+        pass
+
+    def run_phase_check_sdist_log(self):
+        pass
+
+
+class MatrixScheduleTests (unittest.TestCase):
+    def test_failing_interpreter_leaves_the_others_running(self):
+        s = FakeSession(failfast=False, failing='run_phase_unittest')
+        sched = schedule_phases(s, 4)
+
+        self.assertRaises(SystemExit, sched.run)
+        self.assertFalse(s.cancelled.is_set())
+        self.assertIn(('py3', 'generate_coverage_reports'), s.log)
+        self.assertNotIn(('py2', 'generate_coverage_reports'), s.log)
+
+        [_, _, py2, py3] = format_matrix_summary(s, sched).splitlines()
+        self.assertEqual(['py2', 'failed'], py2.split()[:2])
+        self.assertEqual(['py3', 'passed'], py3.split()[:2])
+
+    def test_failing_shared_phase_stops_every_interpreter(self):
+        s = FakeSession(failfast=False, failing=None)
+        started = threading.Semaphore(0)
+
+        def prepare_virtualenv():
+            # Runs a command until the failing flake8 cancels it:
+            started.release()
+            s.cancelled.wait(10)
+            raise io.Cancelled(['virtualenv'])
+
+        def run_phase_flake8():
+            for _ in s.interpreters:
+                started.acquire()
+            raise SystemExit(1)
+
+        for py in s.interpreters:
+            py.prepare_virtualenv = prepare_virtualenv
+        s.run_phase_flake8 = run_phase_flake8
+        sched = schedule_phases(s, 4)
+
+        self.assertRaises(SystemExit, sched.run)
+        self.assertEqual(set(['flake8']), sched.failures)
+        self.assertEqual(
+            set(['virtualenv[py2]', 'virtualenv[py3]']),
+            sched.cancelled)
+
+        [_, _, py2, py3] = format_matrix_summary(s, sched).splitlines()
+        self.assertEqual(['py2', 'stopped'], py2.split()[:2])
+        self.assertEqual(['py3', 'stopped'], py3.split()[:2])
+
+    def test_failfast_cancels_every_interpreter(self):
+        s = FakeSession(failfast=True, failing='prepare_virtualenv')
+        sched = schedule_phases(s, 1)
+
+        self.assertRaises(SystemExit, sched.run)
+        self.assertTrue(s.cancelled.is_set())
+        self.assertEqual([], s.log)
+
+
+class CancelOnTerminationTests (unittest.TestCase):
+    @patch('onslaught.run.os.kill')
+    def test_hangup_cancels_before_dying(self, m_kill):
+        s = Mock()
+        self.assertEqual(signal.SIG_DFL, signal.getsignal(signal.SIGHUP))
+
+        with _cancel_on_termination(s):
+            handler = signal.getsignal(signal.SIGHUP)
+            handler(signal.SIGHUP, None)
+
+        s.cancel.assert_called_once_with()
+        m_kill.assert_called_once_with(os.getpid(), signal.SIGHUP)
+        self.assertEqual(signal.SIG_DFL, signal.getsignal(signal.SIGHUP))
+
+    def test_other_handlers_are_kept(self):
+        handler = Mock()
+        previous = signal.signal(signal.SIGTERM, handler)
+        self.addCleanup(signal.signal, signal.SIGTERM, previous)
+
+        with _cancel_on_termination(Mock()):
+            self.assertIs(handler, signal.getsignal(signal.SIGTERM))
+
+
+@patch('onslaught.run.init_logging')
+class ParseArgsTests (unittest.TestCase):
+    @patch('onslaught.io.provider.find_executable')
+    def test_python_paths_are_expanded(self, m_find_executable, m_logging):
+        opts = parse_args(['--python=~/bin/python3', '-p', 'python2'])
+
+        self.assertEqual(
+            [io.provider.expanduser('~/bin/python3'), 'python2'],
+            opts.PYTHONS)
+        self.assertEqual(
+            [
+                ((io.provider.expanduser('~/bin/python3'),), {}),
+                (('python2',), {}),
+            ],
+            m_find_executable.call_args_list)
+
+    @patch('sys.stderr')
+    def test_missing_python_is_a_usage_error(self, m_stderr, m_logging):
+        self.assertRaises(
+            SystemExit,
+            parse_args,
+            ['--python', '/no/such/python'])
+
+        printed = ''.join(c[0][0] for c in m_stderr.write.call_args_list)
+        self.assertIn("--python '/no/such/python' is not an interpreter",
+                      printed)
@@ -0,0 +1,102 @@
+import threading
+import unittest
+
+from onslaught.schedule import Scheduler
+
+
+class SchedulerTests (unittest.TestCase):
+    def test_dependency_order(self):
+        order = []
+        sched = Scheduler(4)
+        sched.add('a', lambda: order.append('a'))
+        sched.add('b', lambda: order.append('b'), 'a')
+        sched.add('c', lambda: order.append('c'), 'a', 'b')
+        sched.run()
+
+        self.assertEqual(['a', 'b', 'c'], order)
+
+    def test_serial_preserves_insertion_order(self):
+        order = []
+        sched = Scheduler(1)
+        for name in 'xyzw':
+            sched.add(name, lambda name=name: order.append(name))
+        sched.run()
+
+        self.assertEqual(list('xyzw'), order)
+
+    def test_concurrency_limit(self):
+        lock = threading.Lock()
+        active = [0]
+        peak = [0]
+        release = threading.Event()
+
+        def task():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            release.wait(0.2)
+            with lock:
+                active[0] -= 1
+
+        sched = Scheduler(2)
+        for name in 'abcde':
+            sched.add(name, task)
+        sched.run()
+
+        self.assertEqual(2, peak[0])
+
+    def test_failure_stops_scheduling_and_reraises(self):
+        ran = []
+
+        def fail():
+            raise SystemExit(1)
+
+        sched = Scheduler(1)
+        sched.add('ok', lambda: ran.append('ok'))
+        sched.add('fail', fail)
+        sched.add('after', lambda: ran.append('after'))
+
+        self.assertRaises(SystemExit, sched.run)
+        self.assertEqual(['ok'], ran)
+
+    def test_failure_cancels_running_tasks(self):
+        cancelled = threading.Event()
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            if not cancelled.wait(10):
+                raise AssertionError('Not cancelled')
+
+        def fail():
+            started.wait(10)
+            raise SystemExit(1)
+
+        sched = Scheduler(2, cancel=cancelled.set)
+        sched.add('slow', slow)
+        sched.add('fail', fail)
+
+        self.assertRaises(SystemExit, sched.run)
+        self.assertEqual(set(['slow']), sched.succeeded)
+        self.assertEqual(set(['slow', 'fail']), set(sched.durations))
+        self.assertEqual('fail', sched.failed)
+
+    def test_isolated_failure_skips_only_its_dependents(self):
+        ran = []
+        cancelled = threading.Event()
+
+        def fail():
+            raise SystemExit(1)
+
+        sched = Scheduler(1, cancel=cancelled.set)
+        sched.add('shared', lambda: ran.append('shared'))
+        sched.add('a1', fail, 'shared', isolated=True)
+        sched.add('a2', lambda: ran.append('a2'), 'a1', isolated=True)
+        sched.add('b1', lambda: ran.append('b1'), 'shared', isolated=True)
+        sched.add('b2', lambda: ran.append('b2'), 'b1', isolated=True)
+
+        self.assertRaises(SystemExit, sched.run)
+        self.assertEqual(['shared', 'b1', 'b2'], ran)
+        self.assertEqual(set(['a1']), sched.failures)
+        self.assertEqual('a1', sched.failed)
+        self.assertFalse(cancelled.is_set())
@@ -1,14 +1,28 @@
 import sys
+import json
+import errno
+import shutil
+import tempfile
+import unittest
 from mock import call, patch
 
-from onslaught.session import Session
+from onslaught import io
+
+from onslaught.analyzers import Tail
+from onslaught.cache import Cache, content_key
+from onslaught.consts import ExitUserFail
+from onslaught.session import (
+    Session,
+    _COVERAGE_REPORT_SCRIPT,
+    _TESTTIMES_SCRIPT,
+)
 from onslaught.path import Path
 from onslaught.tests.mockutil import MockingTestCase
 
 
 class SessionTestBase (MockingTestCase):
     def setUp(self):
-        self.s = Session()
+        self.s = Session(cache=Cache(Path('/cache')))
 
         p = patch('onslaught.io.provider')
         self.addCleanup(p.stop)
@@ -20,8 +34,15 @@ class SessionTestBase (MockingTestCase):
         self.m_iop.dirname = lambda p: ('dirname', p)
         self.m_iop.isabs = lambda _: True
         self.m_iop.join = lambda *a: ('join', a)
+        self.m_iop.basename = lambda p: p[1][-1]
+        self.m_iop.listdir.return_value = ['targetsrc', 'venv']
+        self.m_iop.synctree.return_value = []
+        self.m_iop.gather_output.return_value = 'foopkg'
+        self.m_iop.exists.return_value = False
+        self.m_iop.getpid.return_value = 42
 
         self.s.initialize('targetfoo', 'resultsbar')
+        self.addCleanup(self.s.close)
 
     def assert_iop_calls(self, *calls):
         self.assert_calls_equal(self.m_iop, calls)
@@ -29,16 +50,43 @@ class SessionTestBase (MockingTestCase):
 
 class SessionInitializeTest (SessionTestBase):
     def test_initialize(self):
+        key = content_key(sys.executable, '', '', '')
+        entry = ('join', ('/cache', 'pkgnames', key))
+        staging = ('join', (('dirname', entry), key + '.42'))
+        trash = ('join', (('abs', 'resultsbar'), '.trash'))
+        [binpath] = [
+            c[1][0] for c in self.m_iop.mock_calls
+            if c[0] == 'ensure_is_directory' and c[1][0][1][0] == trash]
+        self.assertTrue(binpath[1][1].startswith('42.'), binpath)
+
         self.assert_iop_calls(
+            call.exists(('join', (('abs', 'targetfoo'), 'setup.py'))),
+            call.exists(('join', (('abs', 'targetfoo'), 'setup.cfg'))),
+            call.exists(('join', (('abs', 'targetfoo'), 'pyproject.toml'))),
+            call.exists(('join', (entry, 'name'))),
             call.gather_output(
                 sys.executable,
                 ('join', (('abs', 'targetfoo'), 'setup.py')),
-                '--name'),
-            call.rmtree(('abs', 'resultsbar')),
+                '--name',
+                timeout=None),
+            call.getpid(),
+            call.exists(('dirname', entry)),
+            call.rmtree(staging),
+            call.ensure_is_directory(staging),
+            call.write(('join', (staging, 'name')), 'foopkg'),
+            call.rename(staging, entry),
             call.ensure_is_directory(('abs', 'resultsbar')),
-            call.copytree(
+            call.listdir(('abs', 'resultsbar')),
+            call.getpid(),
+            call.ensure_is_directory(binpath),
+            call.rename(
+                ('join', (('abs', 'resultsbar'), 'venv')),
+                ('join', (binpath, 'venv'))),
+            call.rmtree_background(trash),
+            call.synctree(
                 ('abs', 'targetfoo'),
-                ('join', (('abs', 'resultsbar'), 'targetsrc'))),
+                ('join', (('abs', 'resultsbar'), 'targetsrc')),
+                Session._SNAPSHOT_EXCLUDES),
             call.ensure_is_directory(
                 ('dirname',
                  ('join', (('abs', 'resultsbar'), 'logs', 'main.log')))),
@@ -56,51 +104,617 @@ class SessionTests (SessionTestBase):
         self.m_iop.reset_mock()
 
     @patch('onslaught.session.Session._run')
-    @patch('onslaught.session.Session._simplify_coverage_paths')
-    @patch('onslaught.session.Session._display_coverage_to_stdout')
-    def test_generate_coverage_reports(self, m_S_dcts, m_S_scp, m_S_run):
+    @patch('onslaught.session.Session._run_phase')
+    def test_run_phase_unittest_parallel(self, m_S_run_phase, m_S_run):
+        self.s._testjobs = 4
+        self.m_iop.listdir.return_value = [
+            '.coverage',
+            '.coverage.host.42.123',
+            '_trial_temp']
+
+        self.s.run_phase_unittest()
+
+        datafile = ('join', (('abs', 'resultsbar'), 'workdir', '.coverage'))
+        rcfile = ('join', (('abs', 'resultsbar'), 'coveragerc'))
+        timesjson = (
+            'join', (('abs', 'resultsbar'), 'workdir', 'testtimes.json'))
+        self.assert_iop_calls(
+            call.listdir(('dirname', datafile)),
+            call.rmtree(('join', (('dirname', datafile), '.coverage'))),
+            call.rmtree(
+                ('join', (('dirname', datafile), '.coverage.host.42.123'))),
+            call.write(
+                rcfile,
+                '[run]\n'
+                'branch = True\n'
+                'parallel = True\n'
+                'source = foopkg\n'
+                'data_file = {}\n'.format(datafile)),
+            call.exists(timesjson))
+
+        vbin = ('join', (('abs', 'resultsbar'), 'venv', 'bin'))
+        [(args, kw)] = m_S_run_phase.call_args_list
+        self.assertEqual(
+            ('unittests',
+             Path(('join', (vbin, 'coverage'))),
+             'run',
+             '--rcfile', Path(rcfile),
+             _TESTTIMES_SCRIPT,
+             Path(timesjson),
+             Path(('join', (vbin, 'trial'))),
+             '--jobs', '4',
+             'foopkg'),
+            args)
+        self.assertEqual({'COVERAGE_PROCESS_START': rcfile}, kw['env'])
+
+        self.assert_calls_equal(
+            m_S_run,
+            [call(
+                'coverage-combine',
+                Path(('join', (vbin, 'coverage'))),
+                'combine',
+                '--rcfile', Path(rcfile))])
+
+    @patch('onslaught.session.Session._test_map_path')
+    @patch('onslaught.session.Session._sdist_directories')
+    def test__select_tests(self, m_S_sd, m_S_tmp):
+        m_S_sd.return_value = None
+        m_S_tmp.return_value = Path('/state.json')
+        self.m_iop.exists.return_value = True
+        self.m_iop.read.return_value = json.dumps({
+            'tests': {
+                'foopkg.tests.test_a': ['foopkg/a.py', 'foopkg/tests/t.py'],
+                'foopkg.tests.test_b': ['foopkg/b.py'],
+            },
+            'pending': ['foopkg/a.py'],
+            'fastruns': 3,
+        })
+
+        self.s._changed = set(['README.rst'])
+        self.assertEqual(['foopkg.tests.test_a'], self.s._select_tests())
+
+        self.s._changed = set(['foopkg/c.py'])
+        self.assertIsNone(self.s._select_tests())
+
+        # Changes stay pending until a run passes:
+        self.assertEqual(
+            [['README.rst', 'foopkg/a.py'], ['foopkg/a.py', 'foopkg/c.py']],
+            [json.loads(c[1][1])['pending']
+             for c in self.m_iop.write.mock_calls])
+
+    @patch('onslaught.session.Session._run')
+    def test_generate_coverage_reports(self, m_S_run):
+        self.m_iop.exists.return_value = True
+
         self.s.generate_coverage_reports()
 
-        self.assert_iop_calls()  # There is no unintercepted IO.
+        self.assert_iop_calls(
+            call.rmtree(('join', (('abs', 'resultsbar'), 'coverage'))),
+            call.exists(
+                ('join', (('abs', 'resultsbar'), 'workdir', '.coverage'))))
 
         self.assert_calls_equal(
             m_S_run,
             [call(
-                'coverage-report-html',
+                'coverage-report',
                 Path(('join',
                       (('join', (('abs', 'resultsbar'), 'venv', 'bin')),
-                       'coverage'))),
-                'html',
-                '--directory',
-                Path(('join', (('abs', 'resultsbar'), 'coverage.orig'))))])
+                       'python'))),
+                _COVERAGE_REPORT_SCRIPT,
+                '--data-file',
+                Path(('join',
+                      (('abs', 'resultsbar'), 'workdir', '.coverage'))),
+                '--html-dir',
+                Path(('join', (('abs', 'resultsbar'), 'coverage'))),
+                '--json',
+                Path(('join', (('abs', 'resultsbar'), 'coverage.json')))),
+             call().read()])
+
+    def test__run_records_usage(self):
+        self.m_iop.run_with_usage.return_value = io.ProcessUsage(
+            returncode=0, wall=2.5, utime=1.5, stime=0.5, maxrss=2048)
+
+        logpath = self.s._run('phase.foo', 'foo', '--bar')
+
+        logsdir = ('dirname',
+                   ('join', (('abs', 'resultsbar'), 'logs', 'main.log')))
+        self.assertEqual(Path(('join', (logsdir, '00.phase.foo.log'))),
+                         logpath)
+
+        [(manifestpath, manifest)] = [
+            c[1] for c in self.m_iop.write.mock_calls]
+        self.assertEqual(('join', (('abs', 'resultsbar'), 'run.json')),
+                         manifestpath)
+
+        [command] = json.loads(manifest)['commands']
+        self.assertEqual(
+            {'name': 'phase.foo',
+             'args': ['foo', '--bar'],
+             'cwd': None,
+             'log': ['join', ['logs', '00.phase.foo.log']],
+             'exitstatus': 0,
+             'wall_seconds': 2.5,
+             'user_seconds': 1.5,
+             'sys_seconds': 0.5,
+             'maxrss_kib': 2048},
+            command)
+
+    def test_reset_manifest_forgets_earlier_commands(self):
+        self.m_iop.run_with_usage.return_value = io.ProcessUsage(
+            returncode=0, wall=0.0, utime=0.0, stime=0.0, maxrss=0)
+        self.m_iop.gather_output.return_value = '/usr/bin/python3\n3.6.15'
+        view = self.s._for_python('python3', 'python3')
+
+        self.s._run('phase.foo', 'foo')
+        self.s.reset_manifest()
+        view._run('phase.bar', 'bar')
+
+        manifest = self.m_iop.write.mock_calls[-1][1][1]
+        self.assertEqual(
+            ['phase.bar'],
+            [c['name'] for c in json.loads(manifest)['commands']])
+
+    def test__run_failure_reports_log(self):
+        self.m_iop.run_with_usage.return_value = io.ProcessUsage(
+            returncode=3, wall=0.0, utime=0.0, stime=0.0, maxrss=0)
 
+        with self.assertRaises(io.CalledProcessError) as cm:
+            self.s._run('phase.foo', 'foo')
+
+        self.assertEqual(3, cm.exception.returncode)
+        self.assertEqual(
+            '00.phase.foo.log',
+            cm.exception.logpath.pathstr[1][-1])
+        self.assertEqual([], cm.exception.tail.lines)
+
+    def test_packagename_read_statically(self):
+        self.m_iop.exists.return_value = True
+        self.m_iop.read.return_value = 'setup(name="barpkg")\n'
+
+        self.assertEqual('barpkg', self.s._init_packagename())
+        self.assertFalse(self.m_iop.gather_output.called)
+
+    def test__run_refuses_after_cancel(self):
+        self.s.cancel()
+        self.assertRaises(io.Cancelled, self.s._run, 'phase.foo', 'foo')
+        self.m_iop.cancel_running.assert_called_once_with()
+        self.assertFalse(self.m_iop.run_with_usage.called)
+
+        self.s.reset_cancel()
+        self.m_iop.run_with_usage.return_value = io.ProcessUsage(
+            returncode=0, wall=0.0, utime=0.0, stime=0.0, maxrss=0)
+        self.s._run('phase.foo', 'foo')
+        self.assertTrue(self.m_iop.run_with_usage.called)
+
+    def test_report_test_times(self):
+        self.s._logfiles['phase.unittests'] = '03.phase.unittests.log'
+        self.m_iop.exists.return_value = True
+        self.m_iop.read.return_value = json.dumps(
+            {'foopkg.test.T.test_a': 0.5, 'foopkg.test.T.test_b': 2.0})
+
+        with patch.object(self.s, '_log') as m_log:
+            self.s._report_test_times(Path('times.json'))
+
+        [(_, args, _)] = m_log.info.mock_calls
+        self.assertEqual(
+            '    2.000s  foopkg.test.T.test_b\n'
+            '    0.500s  foopkg.test.T.test_a\n',
+            args[-1])
+
+        logsdir = ('dirname',
+                   ('join', (('abs', 'resultsbar'), 'logs', 'main.log')))
+        self.m_iop.rename.assert_called_once_with(
+            'times.json',
+            ('join', (logsdir, '03.phase.unittests.times.json')))
+
+    def test_report_test_times_truncated(self):
+        self.m_iop.exists.return_value = True
+        self.m_iop.read.return_value = '{"foopkg.test.T.test_a": 0.'
+
+        with patch.object(self.s, '_log') as m_log:
+            self.s._report_test_times(Path('times.json'))
+
+        self.assertEqual(1, len(m_log.warn.mock_calls))
+        self.assertFalse(self.m_iop.rename.called)
+
+    @patch('onslaught.session.Session._run_phase')
+    def test_sdist_warnings_fail_check_phase(self, m_S_run_phase):
+        self.m_iop.listdir.return_value = ['foopkg-0.1.tar.gz']
+        self.m_iop.treehash.return_value = 'snapshothash'
+        self.m_iop.exists.return_value = False
+        self.s.run_phase_setup_sdist()
+
+        (_, kw) = m_S_run_phase.call_args
+        [analyzer] = kw['analyzers']
+        analyzer.feed('running sdist\n')
+        analyzer.feed('warning: sdist: no README\n')
+
+        self.m_iop.reset_mock()
+        self.assertRaises(SystemExit, self.s.run_phase_check_sdist_log)
+
+        logsdir = ('dirname',
+                   ('join', (('abs', 'resultsbar'), 'logs', 'main.log')))
         self.assert_calls_equal(
-            m_S_scp,
+            self.m_iop.write,
             [call(
-                Path(('join', (('abs', 'resultsbar'), 'coverage.orig'))),
-                Path(('join', (('abs', 'resultsbar'), 'coverage'))))])
+                ('join', (logsdir, '00.phase.check-sdist-log.log')),
+                'warning: sdist: no README\n')])
+
+    @patch('onslaught.session.Session._run_phase')
+    def test_cached_sdist_log_is_checked(self, m_S_run_phase):
+        self.m_iop.listdir.return_value = ['foopkg-0.1.tar.gz']
+        self.m_iop.treehash.return_value = 'snapshothash'
+        self.m_iop.exists.return_value = True
+        self.m_iop.read.return_value = 'warning: sdist: no README\n'
+
+        self.s.run_phase_setup_sdist()
 
+        self.assert_calls_equal(m_S_run_phase, [])
+        entry = ('join', ('/cache', 'sdists', content_key(
+            sys.executable, sys.version, 'snapshothash')))
+        distdir = ('join', (('abs', 'resultsbar'), 'dist'))
         self.assert_calls_equal(
-            m_S_dcts,
-            [call()])
+            self.m_iop.copyfile,
+            [call(('join', (entry, 'setup-sdist.log')),
+                  ('join', (('dirname', ('join', (('abs', 'resultsbar'),
+                                                  'logs',
+                                                  'main.log'))),
+                            '00.phase.setup-sdist.log'))),
+             call(('join', (('join', (entry, 'dist')), 'foopkg-0.1.tar.gz')),
+                  ('join', (distdir, 'foopkg-0.1.tar.gz')))])
 
-    @patch('onslaught.session.Session._run')
-    @patch('onslaught.session.Session._replace_venv_paths')
-    def test__display_coverage_to_stdout(self, m_S_rvp, m_S_run):
-        self.s._display_coverage_to_stdout()
+        self.assertRaises(SystemExit, self.s.run_phase_check_sdist_log)
+        self.assertEqual(set(['setup-sdist']), self.s.cached_phases())
+
+    @patch('onslaught.session.Session._run_phase')
+    def test_build_wheel_cached(self, m_S_run_phase):
+        self.s._sdistentry = Path('/sdistentry')
+        self.m_iop.exists.return_value = True
+        self.m_iop.listdir.return_value = ['foopkg-0.1-py2-none-any.whl']
 
-        self.assert_iop_calls()  # There is no unintercepted IO.
+        self.s.run_phase_build_wheel()
+        self.s.run_phase_install_sdist()
+        self.assertEqual(set(['build-wheel']), self.s.cached_phases())
 
+        wheel = ('join', (('abs', 'resultsbar'),
+                          'dist',
+                          'foopkg-0.1-py2-none-any.whl'))
         self.assert_calls_equal(
-            m_S_run,
+            self.m_iop.copyfile,
+            [call(('join', (('join', ('/sdistentry', 'wheels')),
+                            'foopkg-0.1-py2-none-any.whl')),
+                  wheel)])
+        self.assert_calls_equal(
+            m_S_run_phase,
             [call(
-                'coverage-report-stdout',
+                'install-sdist',
                 Path(('join',
                       (('join', (('abs', 'resultsbar'), 'venv', 'bin')),
-                       'coverage'))),
-                'report'),
-             call().read()])
+                       'pip'))),
+                '--verbose',
+                'install',
+                Path(wheel))])
+
+    @patch('onslaught.session.Session._run')
+    @patch('onslaught.session.Session._run_phase')
+    def test_reinstall_replaces_previous_install(self, m_S_run_phase, m_S_run):
+        self.s._wheel = Path('foopkg-0.1-py2-none-any.whl')
+        pip = Path(('join', (('join', (('abs', 'resultsbar'), 'venv', 'bin')),
+                             'pip')))
+
+        self.s.run_phase_install_sdist()
+        self.assert_calls_equal(m_S_run, [])
+
+        self.s.run_phase_install_sdist()
+        self.assert_calls_equal(
+            m_S_run,
+            [call('pip-uninstall', pip, '--verbose', 'uninstall', '--yes',
+                  'foopkg')])
+        self.assert_calls_equal(
+            m_S_run_phase,
+            [call('install-sdist', pip, '--verbose', 'install',
+                  Path('foopkg-0.1-py2-none-any.whl'))] * 2)
+
+    @patch('onslaught.session.Session._run')
+    def test_prepare_virtualenv_cached(self, m_S_run):
+        self.m_iop.exists.return_value = True
+        self.m_iop.listdir.return_value = []
+        self.m_iop.read.return_value = '/build/venv'
+
+        self.s.prepare_virtualenv()
+
+        entry = ('join', ('/cache', 'venvs', self._venv_cache_key()))
+        resvenv = ('join', (('abs', 'resultsbar'), 'venv'))
+        self.assert_iop_calls(
+            call.exists(('join', (entry, 'complete'))),
+            call.rmtree(resvenv),
+            call.exists(('join', (entry, 'spares'))),
+            call.listdir(('join', (entry, 'spares'))),
+            call.copytree(('join', (entry, 'venv')), resvenv),
+            call.read(('join', (entry, 'complete'))),
+            call.listdir(('join', (resvenv, 'bin'))))
+
+        self.assert_calls_equal(m_S_run, [])
+
+    @patch('onslaught.session.Session._run')
+    def test_prepare_virtualenv_claims_spare(self, m_S_run):
+        self.m_iop.exists.return_value = True
+        self.m_iop.read.return_value = '/build/venv'
+        self.m_iop.listdir.side_effect = [['7.0', '7.1'], []]
+        self.m_iop.rename.side_effect = [OSError(errno.ENOENT, 'taken'), None]
+
+        self.s.prepare_virtualenv()
+
+        spares = ('join', (
+            ('join', ('/cache', 'venvs', self._venv_cache_key())),
+            'spares'))
+        resvenv = ('join', (('abs', 'resultsbar'), 'venv'))
+        self.assert_calls_equal(
+            self.m_iop.rename,
+            [call(('join', (spares, '7.0')), resvenv),
+             call(('join', (spares, '7.1')), resvenv)])
+        self.assertFalse(self.m_iop.copytree.called)
+
+    @patch('onslaught.session.Session._run')
+    def test_prepare_virtualenv_uncached(self, m_S_run):
+        self.m_iop.exists.return_value = False
+        self.m_iop.listdir.return_value = []
+        self.m_iop.getpid.return_value = 42
+        self.m_iop.read.return_value = '/build/venv'
+        self.m_iop.gather_output.return_value = '/site'
+
+        self.s.prepare_virtualenv()
+
+        key = self._venv_cache_key()
+        entry = ('join', ('/cache', 'venvs', key))
+        staging = ('join', (('dirname', entry), key + '.42'))
+        baseline = ('join', (staging, 'venv'))
+        resvenv = ('join', (('abs', 'resultsbar'), 'venv'))
+        wheelhouse = ('join', ('/cache', 'wheelhouse'))
+        fills = []
+        for spec in Session._TEST_DEPENDENCIES:
+            fillkey = content_key(sys.executable, sys.version, spec)
+            filled = ('join', ('/cache', 'wheelhouse.filled', fillkey))
+            fills.append((filled, ('join', (('dirname', filled),
+                                            fillkey + '.42'))))
+
+        fillcalls = []
+        for (filled, wheels) in fills:
+            fillcalls.extend([
+                call.exists(filled),
+                call.getpid(),
+                call.exists(('dirname', filled)),
+                call.rmtree(wheels),
+                call.ensure_is_directory(wheels),
+                call.ensure_is_directory(wheelhouse),
+                call.listdir(wheels),
+                call.rename(wheels, filled)])
+
+        self.assert_iop_calls(*(
+            [call.exists(('join', (entry, 'complete'))),
+             call.getpid(),
+             call.exists(('dirname', entry)),
+             call.rmtree(staging),
+             call.ensure_is_directory(staging)] +
+            fillcalls +
+            [call.gather_output(
+                ('join', (('join', (baseline, 'bin')), 'python')),
+                '-c',
+                'from distutils.sysconfig import get_python_lib; '
+                'print(get_python_lib())',
+                timeout=None),
+             call.write(
+                 ('join', ('/site', 'onslaught-coverage.pth')),
+                 Session._COVERAGE_PTH),
+             call.write(('join', (staging, 'complete')), baseline),
+             call.rename(staging, entry),
+             call.rmtree(resvenv),
+             call.exists(('join', (entry, 'spares'))),
+             call.copytree(('join', (entry, 'venv')), resvenv),
+             call.read(('join', (entry, 'complete'))),
+             call.listdir(('join', (resvenv, 'bin')))]))
+
+        basepip = Path(('join', (('join', (baseline, 'bin')), 'pip')))
+        expected = [
+            call(
+                'virtualenv',
+                'virtualenv',
+                '--python', sys.executable,
+                Path(baseline))]
+
+        for (spec, (_, wheels)) in zip(Session._TEST_DEPENDENCIES, fills):
+            name = spec.split()[0]
+            expected.extend([
+                call(
+                    'pip-wheel.' + name,
+                    basepip,
+                    '--verbose',
+                    'wheel',
+                    '--wheel-dir', Path(wheels),
+                    spec),
+                call(
+                    'pip-install.' + name,
+                    basepip,
+                    '--verbose',
+                    'install',
+                    '--no-index',
+                    '--find-links', Path(wheelhouse),
+                    spec)])
+
+        self.assert_calls_equal(m_S_run, expected)
+
+    @patch('onslaught.session.Session._run')
+    def test_wheels_are_renamed_into_wheelhouse(self, m_S_run):
+        self.m_iop.exists.return_value = False
+        self.m_iop.listdir.return_value = ['zope.whl', 'twisted.whl']
+
+        self.s._install('twisted', Path('/bin'), 'twisted')
+
+        key = content_key(sys.executable, sys.version, 'twisted')
+        filled = ('join', ('/cache', 'wheelhouse.filled', key))
+        wheels = ('join', (('dirname', filled), key + '.42'))
+        wheelhouse = ('join', ('/cache', 'wheelhouse'))
+        self.assert_calls_equal(
+            self.m_iop.rename,
+            [call(('join', (wheels, 'zope.whl')),
+                  ('join', (wheelhouse, 'zope.whl'))),
+             call(('join', (wheels, 'twisted.whl')),
+                  ('join', (wheelhouse, 'twisted.whl'))),
+             call(wheels, filled)])
+
+    @patch('onslaught.session.Session._run')
+    def test_failed_virtualenv_build_removes_staging(self, m_S_run):
+        self.m_iop.exists.side_effect = [False, True]
+        self.m_iop.getpid.return_value = 42
+        self.m_iop.is_running.side_effect = lambda pid: pid in (9, 42)
+        m_S_run.side_effect = SystemExit(ExitUserFail)
 
+        key = self._venv_cache_key()
+        entry = ('join', ('/cache', 'venvs', key))
+        self.m_iop.listdir.return_value = [
+            key, key + '.7', key + '.9', key + '.42', 'other.8', 'other']
+
+        self.assertRaises(SystemExit, self.s.prepare_virtualenv)
+
+        [dead, otherdead, staging] = [
+            ('join', (('dirname', entry), name))
+            for name in [key + '.7', 'other.8', key + '.42']]
         self.assert_calls_equal(
-            m_S_rvp,
-            [call(m_S_run().read(), '...')])
+            self.m_iop.rmtree,
+            [call(dead), call(otherdead), call(staging), call(staging)])
+        self.assertFalse(self.m_iop.rename.called)
+
+    def _venv_cache_key(self):
+        return content_key(
+            Session._VENV_CACHE_FORMAT,
+            sys.executable,
+            sys.version,
+            Session._COVERAGE_PTH,
+            *Session._TEST_DEPENDENCIES)
+
+
+class MatrixTests (SessionTestBase):
+    def setUp(self):
+        SessionTestBase.setUp(self)
+        pathbasename = self.m_iop.basename
+        self.m_iop.basename = lambda p: (
+            p.split('/')[-1] if isinstance(p, str) else pathbasename(p))
+        self.m_iop.gather_output.side_effect = [
+            'foopkg',
+            '/usr/bin/python2.7\n2.7.18',
+            '/opt/py3/bin/python3\n3.9.18 (main)\n[GCC]',
+            '/usr/bin/python3\n3.11.7']
+        self.s = Session(
+            cache=Cache(Path('/cache')),
+            pythons=['python2.7', '/opt/py3/bin/python3', 'python3'])
+        self.s.initialize('targetfoo', 'resultsbar')
+        self.addCleanup(self.s.close)
+
+    def test_interpreters(self):
+        [py2, py3, py3b] = self.s.interpreters
+
+        self.assertEqual(
+            ['python2.7', 'python3', 'python3-2'],
+            [py.label for py in self.s.interpreters])
+        self.assertEqual('unittests[python3]', py3.phase_name('unittests'))
+        self.assertEqual('unittests', self.s.phase_name('unittests'))
+        self.assertEqual(
+            ('/opt/py3/bin/python3', '3.9.18 (main)\n[GCC]'),
+            (py3._python, py3._pyversion))
+        self.assertEqual(
+            Path(('join', (('abs', 'resultsbar'), 'pythons', 'python3'))),
+            py3._pyresdir)
+        self.assertEqual(
+            Path(('join', (('join', (('abs', 'resultsbar'),
+                                     'pythons',
+                                     'python3')),
+                           'venv',
+                           'bin'))),
+            py3._vbin)
+
+    def test_views_share_the_sdist(self):
+        [py2, _, _] = self.s.interpreters
+        self.s._sdistentry = Path('/sdistentry')
+
+        self.assertEqual(
+            Path(('join', ('/sdistentry', 'wheels.{}'.format(
+                content_key('/usr/bin/python2.7', '2.7.18'))))),
+            py2._wheels_entry())
+
+
+class Flake8CacheTests (unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp(prefix='onslaught-test-')
+        self.addCleanup(shutil.rmtree, tmp)
+
+        self.target = Path(tmp)('target')
+        for relpath in ['a.py', 'pkg/b.py', '.git/c.py', 'README']:
+            self.target(relpath).parent.ensure_is_directory()
+            self.target(relpath).write('x = 1\n')
+
+        self.s = Session(cache=Cache(Path(tmp)('cache')))
+        self.s._realtarget = self.target
+        self.logdir = Path(tmp)('logs')
+        self.logdir.ensure_is_directory()
+        self.linted = []
+        self.output = None
+
+    def _fake_run(self, logname, *args):
+        logpath = self.logdir(logname)
+        if logname == 'flake8-version':
+            logpath.write('1.0\n')
+            return logpath
+
+        paths = [a.pathstr for a in args[1:]]
+        self.linted.append(sorted(paths))
+        logpath.write(self.output or ''.join(
+            '{}:1:1: F000 checked\n'.format(p) for p in paths))
+
+        e = io.CalledProcessError(1, args)
+        e.logpath = logpath
+        e.tail = Tail(10)
+        e.tail.feed('flake8 output\n')
+        raise e
+
+    @patch('onslaught.session.Session._check_phase')
+    def test_only_changed_files_are_linted(self, m_S_cp):
+        with patch('onslaught.session.Session._run', self._fake_run):
+            self.s.run_phase_flake8()
+            self.target('pkg', 'b.py').write('x = 2\n')
+            self.s.run_phase_flake8()
+
+        [a, b] = [self.target(p).pathstr for p in ['a.py', 'pkg/b.py']]
+        self.assertEqual([[a, b], [b]], self.linted)
+
+        expected = [
+            '{}:1:1: F000 checked\n'.format(p) for p in [a, b]]
+        self.assertEqual(
+            [call('flake8', expected), call('flake8', expected)],
+            m_S_cp.mock_calls)
+
+    @patch('onslaught.session.Session._check_phase')
+    def test_lints_in_chunks(self, m_S_cp):
+        with patch('onslaught.session.Session._run', self._fake_run):
+            with patch.object(Session, '_FLAKE8_CHUNK_FILES', 1):
+                self.s.run_phase_flake8()
+
+        [a, b] = [self.target(p).pathstr for p in ['a.py', 'pkg/b.py']]
+        self.assertEqual([[a], [b]], self.linted)
+
+    @patch('onslaught.session.Session._check_phase')
+    def test_crash_is_not_cached(self, m_S_cp):
+        self.output = (
+            'Traceback (most recent call last):\n'
+            'ImportError: No module named broken_plugin\n')
+
+        with patch('onslaught.session.Session._run', self._fake_run):
+            with patch.object(self.s, '_log') as m_log:
+                self.assertRaises(SystemExit, self.s.run_phase_flake8)
+            self.output = None
+            self.s.run_phase_flake8()
+
+        self.assertEqual(1, len(m_log.warn.mock_calls))
+
+        [a, b] = [self.target(p).pathstr for p in ['a.py', 'pkg/b.py']]
+        self.assertEqual([[a, b], [a, b]], self.linted)
+        self.assertEqual(1, len(m_S_cp.mock_calls))
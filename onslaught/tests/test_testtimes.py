@@ -0,0 +1,35 @@
+import unittest
+
+from onslaught.scripts import testtimes
+
+
+class TestTimesTests (unittest.TestCase):
+    def test_nested_calls_time_the_outermost(self):
+        timer = testtimes.Timer()
+        timer._start('t')
+        timer._start('t')
+        timer._stop('t')
+        self.assertEqual({}, timer.times)
+
+        timer._stop('t')
+        self.assertEqual(['t'], list(timer.times))
+
+    def test_collapse_splits_time_among_callers(self):
+        main = ('main.py', 1, 'main')
+        a = ('main.py', 5, 'a')
+        b = ('main.py', 9, 'b')
+        leaf = ('lib.py', 1, 'leaf')
+        stats = {
+            main: (1, 1, 1.0, 10.0, {}),
+            a: (1, 1, 1.0, 4.0, {main: (1, 1, 1.0, 4.0)}),
+            b: (1, 1, 0.0, 5.0, {main: (1, 1, 0.0, 5.0)}),
+            leaf: (2, 2, 8.0, 8.0, {a: (1, 1, 3.0, 3.0),
+                                    b: (1, 1, 5.0, 5.0)}),
+        }
+
+        self.assertEqual(
+            {'main.py:1(main)': 1.0,
+             'main.py:1(main);main.py:5(a)': 1.0,
+             'main.py:1(main);main.py:5(a);lib.py:1(leaf)': 3.0,
+             'main.py:1(main);main.py:9(b);lib.py:1(leaf)': 5.0},
+            testtimes.collapse(stats))
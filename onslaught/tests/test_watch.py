@@ -0,0 +1,40 @@
+import unittest
+from mock import Mock, call, patch
+
+from onslaught.watch import DebounceDelay, _wait_for_changes
+
+
+class WaitForChangesTests (unittest.TestCase):
+    @patch('time.sleep')
+    def test_syncs_only_when_mtimes_change(self, m_sleep):
+        session = Mock()
+        session.target_mtimes.side_effect = [
+            {'a.py': 1.0},
+            {'a.py': 1.0},
+            {'a.py': 2.0},
+            {'a.py': 2.0},
+        ]
+        session.refresh_target.side_effect = [[], ['a.py']]
+
+        self.assertEqual(['a.py'], _wait_for_changes(session, 1.0))
+
+        # The first poll syncs, to catch edits made during the run:
+        self.assertEqual(2, len(session.refresh_target.mock_calls))
+        self.assertEqual(3, len(m_sleep.mock_calls))
+
+    @patch('time.sleep')
+    def test_debounces_quicker_than_the_poll_interval(self, m_sleep):
+        session = Mock()
+        session.target_mtimes.side_effect = [
+            {'a.py': 1.0},
+            {'a.py': 2.0},
+            {'a.py': 3.0},
+            {'a.py': 3.0},
+        ]
+        session.refresh_target.side_effect = [[], ['a.py'], ['a.py']]
+
+        self.assertEqual(['a.py'], _wait_for_changes(session, 5.0))
+
+        self.assertEqual(
+            [call(5.0), call(DebounceDelay), call(DebounceDelay)],
+            m_sleep.mock_calls)
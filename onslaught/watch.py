@@ -0,0 +1,66 @@
+"""Rerun the phases which changes to a watched target make stale."""
+
+import time
+import logging
+from onslaught.consts import ExitUserFail
+
+
+# Each poll stats the whole target, so idle polls stay a little apart:
+PollInterval = 0.5
+
+# Once something changed, poll quickly until a quiet poll ends the burst
+# of edits, so a save is not held up by a whole poll interval:
+DebounceDelay = 0.1
+
+
+def watch(session, sched, interval=PollInterval):
+    log = logging.getLogger('watch')
+    stale = set(sched.names)
+
+    try:
+        while True:
+            session.reset_cancel()
+            session.reset_manifest()
+            try:
+                sched.run(stale)
+            except SystemExit as e:
+                if e.code != ExitUserFail:
+                    raise
+            stale -= sched.succeeded
+
+            log.info('Watching for changes...')
+            changed = _wait_for_changes(session, interval)
+            log.info('Changed: %s', ', '.join(changed))
+
+            stale |= sched.dependents(session.invalidated_phases(changed))
+            log.debug('Rerunning phases: %r', sorted(stale))
+    except KeyboardInterrupt:
+        log.info('Stopped watching.')
+
+
+def _wait_for_changes(session, interval):
+    # The first poll always syncs, to catch edits made during the run:
+    (mtimes, changed) = _poll(session, None)
+    while not changed:
+        time.sleep(interval)
+        (mtimes, changed) = _poll(session, mtimes)
+
+    more = changed
+    while more:
+        time.sleep(min(DebounceDelay, interval))
+        (mtimes, more) = _poll(session, mtimes)
+        changed.extend(more)
+
+    return sorted(set(changed))
+
+
+def _poll(session, lastmtimes):
+    """Sync the target snapshot only if its mtimes differ from the last.
+
+    Returns the mtimes, and the changed paths.
+    """
+    mtimes = session.target_mtimes()
+    if mtimes == lastmtimes:
+        return (mtimes, [])
+    else:
+        return (mtimes, session.refresh_target())
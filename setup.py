@@ -32,6 +32,7 @@ def setup():
 
         install_requires=[
             'flake8 >= 2.0',
+            'scandir >= 1.5',
             'virtualenv >= 13.1.2',
 
             # For self-unittests, not target testing: